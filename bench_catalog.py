@@ -0,0 +1,64 @@
+"""Compare CatalogParser with the old BeautifulSoup path on course catalog markup.
+
+Usage: python bench_catalog.py [repeat]   (needs beautifulsoup4 installed)
+"""
+import os
+import sys
+import time
+import tracemalloc
+from bs4 import BeautifulSoup
+from study_robot import CatalogParser
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'res.txt')
+
+def parse_bs4(text):
+    soup = BeautifulSoup(text, 'html.parser')
+    items_list = []
+    for item in soup.select('.cl-catalog-item-sub a'):
+        classes = item.get('class', [])
+        items_list.append({
+            'name': item.get('title', ''),
+            'scoId': item.get('data-id', ''),
+            'done': 'item-done' in classes or 'cl-catalog-link-done' in classes
+        })
+    return items_list
+
+def parse_stream(text):
+    parser = CatalogParser()
+    parser.feed(text)
+    parser.close()
+    return parser.items
+
+def scale(text, factor):
+    # 重复 <ol> 中的章节，直到整个页面约为 factor 倍大小(页尾的脚本不随章节增长，只重复章节不够)
+    head, rest = text.split('<ol>', 1)
+    body, tail = rest.split('</ol>', 1)
+    copies = -(-(len(text) * factor - len(head) - len(tail) - 9) // len(body))
+    return f'{head}<ol>{body * copies}</ol>{tail}'
+
+def measure(func, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(text)
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    func(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with open(SAMPLE_FILE, encoding='utf-8') as f:
+        sample = f.read()
+    for label, text in (('res.txt', sample), ('10x', scale(sample, 10))):
+        expected = parse_bs4(text)
+        if parse_stream(text) != expected:
+            raise Exception(f'CatalogParser output differs from BeautifulSoup on {label}')
+        print(f'{label}: {len(text)} bytes, {len(expected)} scos')
+        for name, func in (('BeautifulSoup', parse_bs4), ('CatalogParser', parse_stream)):
+            elapsed, peak = measure(func, text, repeat)
+            print(f'  {name:<14} {elapsed * 1e6:10.1f} us/parse  peak {peak / 1024:8.1f} KiB')
+
+if __name__ == '__main__':
+    main()
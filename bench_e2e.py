@@ -0,0 +1,130 @@
+"""End-to-end throughput/latency benchmark of the bot against mock_server.py.
+
+Starts the mock in a subprocess, runs FleetRunner for N accounts with a
+compressed time_step and reports requests/s, p50/p99 latency, CPU and RSS
+per session:
+
+    python bench_e2e.py --accounts 200 --time-step 0.2 --latency 0.01
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+import configparser
+import study_robot
+from study_robot import FleetRunner, HttpClient, log_writer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='21tb bot end-to-end benchmark')
+    parser.add_argument('--accounts', type=int, default=50)
+    parser.add_argument('--courses', type=int, default=5)
+    parser.add_argument('--scos', type=int, default=4)
+    parser.add_argument('--saves-per-sco', type=int, default=3)
+    parser.add_argument('--max-courses', type=int, default=3)
+    parser.add_argument('--per-host-limit', type=int, default=100)
+    parser.add_argument('--time-step', type=float, default=0.2, help='compressed progress interval in seconds')
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--session-ttl', type=float, default=0)
+    parser.add_argument('--tree', choices=['html', 'json'], default='html')
+    parser.add_argument('--port', type=int, default=8021)
+    return parser.parse_args(argv)
+
+def write_config(args, work_dir):
+    config = configparser.ConfigParser()
+    config.read(os.path.join(BASE_DIR, study_robot.CONFIG_FILE_NAME), encoding='utf-8')
+    config['main'] = {'corpcode': 'bench', 'accounts_file': 'accounts.jsonl'}
+    config['api']['host'] = f'http://127.0.0.1:{args.port}'
+    config['engine']['time_step'] = str(args.time_step)
+    config['engine']['max_courses'] = str(args.max_courses)
+    config['engine']['per_host_limit'] = str(args.per_host_limit)
+    config['http']['backoff_base'] = str(args.time_step / 4)
+    config['cache']['course_tree_file'] = ''
+    config['cache']['checkpoint_file'] = ''
+    config['log']['level'] = 'warning'
+    path = os.path.join(work_dir, study_robot.CONFIG_FILE_NAME)
+    with open(path, 'w', encoding='utf-8') as f:
+        config.write(f)
+    with open(os.path.join(work_dir, 'accounts.jsonl'), 'w', encoding='utf-8') as f:
+        for i in range(args.accounts):
+            f.write(json.dumps({'username': f'bench{i:05d}', 'password': 'x'}) + '\n')
+    return path
+
+def start_mock(args):
+    command = [sys.executable, os.path.join(BASE_DIR, 'mock_server.py'), '--port', str(args.port),
+               '--courses', str(args.courses), '--scos', str(args.scos),
+               '--saves-per-sco', str(args.saves_per_sco), '--latency', str(args.latency),
+               '--error-rate', str(args.error_rate), '--session-ttl', str(args.session_ttl), '--tree', args.tree]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(('127.0.0.1', args.port), timeout=0.2):
+            return process
+        time.sleep(0.1)
+    process.kill()
+    raise Exception('Mock server did not start')
+
+def instrument(latencies):
+    send_once = HttpClient._send_once
+
+    async def timed_send_once(self, method, api, params, headers):
+        start = time.perf_counter()
+        try:
+            return await send_once(self, method, api, params, headers)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    HttpClient._send_once = timed_send_once
+
+def rss_kib():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+def main(argv=None):
+    args = parse_args(argv)
+    latencies = []
+    instrument(latencies)
+    with tempfile.TemporaryDirectory() as work_dir:
+        config_path = write_config(args, work_dir)
+        mock = start_mock(args)
+        try:
+            runner = FleetRunner(config_path)
+            rss_before = rss_kib()
+            cpu_before = time.process_time()
+            wall_before = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                asyncio.run(runner.run())
+                log_writer.flush()
+            wall = time.perf_counter() - wall_before
+            cpu = time.process_time() - cpu_before
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        finally:
+            mock.terminate()
+            mock.wait()
+
+    print(f'accounts:            {args.accounts} ({args.courses} courses x {args.scos} scos each)')
+    print(f'wall time:           {wall:.2f}s')
+    print(f'requests:            {len(latencies)} ({len(latencies) / wall:.1f} req/s)')
+    print(f'latency p50/p99:     {percentile(latencies, 0.5) * 1000:.2f} / {percentile(latencies, 0.99) * 1000:.2f} ms')
+    print(f'CPU per session:     {cpu / args.accounts * 1000:.2f} ms ({cpu / wall * 100:.1f}% of one core)')
+    print(f'RSS per session:     {max(peak_rss - rss_before, 0) / args.accounts:.1f} KiB')
+    print(f'HTTP stats:          {runner.pool.stats}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Per-cycle request construction cost: compiled EndpointRegistry vs the old str.replace path.
+
+A cycle is what one studying sco builds every time_step: save_progress, heartbeat and
+update_timestep, plus the select_check / course_show URLs built when a sco or course starts.
+No network I/O; only URL, form, circuit breaker and label lookup are timed, the new
+path through HttpClient._prepare/_route themselves.
+
+Usage: python bench_request_build.py [cycles]
+"""
+import sys
+import time
+from urllib.parse import urlsplit
+from study_robot import ConfigManager, ConnectionPool, EndpointRegistry, HttpClient, StudyBot, log_writer
+
+COURSE_ID = 'LIV01004_fjnx.com.cn'
+SCO_ID = 'aa1a8a965238fba8161c6bc849adaebd'
+SESSION_ID = 'elnSessionId.4f1c2b7e9d8a4c0f8e3b5a6d7c9e1f20'
+
+class OfflineClient(HttpClient):
+    def __init__(self):
+        super().__init__(pool=ConnectionPool())
+
+    def get_session_id(self):
+        return SESSION_ID
+
+def save_params(location):
+    return {'courseId': COURSE_ID, 'scoId': SCO_ID, 'progress_measure': '100', 'session_time': '0:0:180',
+            'location': location, 'logId': '', 'current_app_id': ''}
+
+class OldBuilder:
+    """The request construction code as it was before the endpoint registry."""
+    def __init__(self, api_config):
+        self.apis = {name: f"{api_config['host']}{api_config[name]}" for name in EndpointRegistry.NAMES}
+        self.headers = dict(HttpClient.HEADERS)
+        self.pool = ConnectionPool()
+
+    def build_api_url(self, api_name, **kwargs):
+        base_url = self.apis[api_name]
+        for key, value in kwargs.items():
+            placeholder = '{' + key + '}'
+            if placeholder in base_url:
+                base_url = base_url.replace(placeholder, str(value))
+        return base_url
+
+    def select_check_url(self):
+        select_check_api = self.apis['select_check']
+        if '{courseId}' in select_check_api and '{scoId}' in select_check_api:
+            return select_check_api.format(courseId=COURSE_ID, scoId=SCO_ID)
+        elif '%s' in select_check_api:
+            return select_check_api % (COURSE_ID, SCO_ID)
+        return select_check_api.replace('{0}', COURSE_ID).replace('{1}', SCO_ID)
+
+    def request(self, api, params):
+        params = {k: str(v) for k, v in {**(params or {}), 'elsSign': SESSION_ID}.items() if v is not None}
+        headers = self.headers
+        breaker = self.pool.host_breaker(urlsplit(api).netloc)
+        return api, params, headers, breaker, urlsplit(api).path.rsplit('/', 1)[-1]
+
+    def cycle(self, location):
+        params = save_params(location)
+        params.update({'courseId': COURSE_ID, 'scoId': SCO_ID, 'location': location})
+        yield self.request(self.apis['save_progress'], params)
+        yield self.request(self.apis['heartbeat'], {'_ajax_toKen': 'os'})
+        yield self.request(self.apis['update_timestep'], None)
+        yield self.request(self.select_check_url(), None)
+        yield self.request(self.build_api_url('course_show', course_id=COURSE_ID, session_id=SESSION_ID), None)
+
+class NewBuilder:
+    def __init__(self, api_config):
+        self.apis = EndpointRegistry(api_config)
+        self.http = OfflineClient()
+
+    def url(self, name, **values):
+        endpoint = self.apis[name]
+        if 'session_id' in endpoint.fields:
+            values['session_id'] = SESSION_ID
+        return endpoint.format(values)
+
+    def request(self, api, params):
+        breaker, label = self.http._route(api)
+        return api, self.http._prepare(params), None, breaker, label
+
+    def cycle(self, location):
+        yield self.request(self.url('save_progress'), save_params(location))
+        yield self.request(self.url('heartbeat'), StudyBot.HEARTBEAT_PARAMS)
+        yield self.request(self.url('update_timestep'), None)
+        yield self.request(self.url('select_check', course_id=COURSE_ID, sco_id=SCO_ID), None)
+        yield self.request(self.url('course_show', course_id=COURSE_ID), None)
+
+def measure(builder, cycles):
+    start = time.perf_counter()
+    for i in range(cycles):
+        for _ in builder.cycle(i * 180.0):
+            pass
+    return (time.perf_counter() - start) / cycles
+
+def main():
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    log_writer.configure(level='warning')
+    config = ConfigManager()
+    config.initialize()
+    api_config = config.get_section_items('api')
+    old, new = OldBuilder(api_config), NewBuilder(api_config)
+
+    old_check = list(old.cycle(180.0))[3][0]
+    new_check = list(new.cycle(180.0))[3][0]
+    print(f'select_check (old): {old_check}')
+    print(f'select_check (new): {new_check}')
+
+    measure(old, 1000), measure(new, 1000)  # 预热
+    old_cost = measure(old, cycles)
+    new_cost = measure(new, cycles)
+    print(f'cycles:              {cycles}')
+    print(f'old per cycle:       {old_cost * 1e6:.2f} us')
+    print(f'registry per cycle:  {new_cost * 1e6:.2f} us ({old_cost / new_cost:.2f}x)')
+
+if __name__ == '__main__':
+    main()
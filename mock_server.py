@@ -0,0 +1,282 @@
+"""Local stand-in for a 21tb tenant, for benchmarks and offline runs.
+
+Serves the endpoints configured in main.conf's [api] section with
+configurable latency, error rate and session expiry:
+
+    python mock_server.py --port 8021 --latency 0.02 --error-rate 0.01 --session-ttl 600
+
+then point [api] host at http://127.0.0.1:8021. --auth elsSign ignores the
+session cookie and authenticates by the first elsSign value only, so requests
+replayed after a re-login must carry the new session id.
+"""
+import os
+import json
+import uuid
+import random
+import asyncio
+import argparse
+import itertools
+from urllib.parse import urlsplit, parse_qsl
+from aiohttp import web
+import study_robot
+from study_robot import ConfigManager, ConnectionPool, HttpClient, Response, log
+
+LOGIN_PAGE_PATH = '/login/login.do'
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'res.txt')
+
+class MockResponse:
+    def __init__(self, status=200, body='', content_type='application/json', cookies=None, location=None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.cookies = cookies or {}
+        self.location = location
+
+    @classmethod
+    def json(cls, data, **kwargs):
+        return cls(body=json.dumps(data, ensure_ascii=False), **kwargs)
+
+class MockTenant:
+    """Server-side state and endpoint logic, independent of the web framework."""
+    def __init__(self, config, courses=20, scos=4, saves_per_sco=3, latency=0.0, error_rate=0.0,
+                 session_ttl=0, tree_format='html', auth='cookie'):
+        self.courses = courses
+        self.scos = scos
+        self.saves_per_sco = saves_per_sco
+        self.latency = latency
+        self.error_rate = error_rate
+        self.session_ttl = session_ttl
+        self.tree_format = tree_format
+        self.auth = auth
+        self.sessions = {}  # eln_session_id -> (username, login time)
+        self.progress = {}  # (username, course_id, sco_id) -> saves
+        self.counts = {}
+        self.routes = {}
+        handlers = {
+            'login': self.login,
+            'course_center': self.course_center,
+            'enter_course': self.page,
+            'course_show': self.page,
+            'course_item': self.course_item,
+            'select_resource': self.select_resource,
+            'select_check': self.select_check,
+            'save_progress': self.save_progress,
+            'update_timestep': self.update_timestep,
+            'heartbeat': self.heartbeat,
+        }
+        for name, path in config.get_section_items('api').items():
+            if name in handlers:
+                self.routes[path.split('?')[0].strip()] = (name, handlers[name])
+        self._tree_tail = ''
+        if os.path.exists(SAMPLE_FILE):
+            with open(SAMPLE_FILE, encoding='utf-8') as f:
+                self._tree_tail = f.read().split('</ol>', 1)[-1]
+
+    async def handle(self, method, path, params, cookies):
+        if path == LOGIN_PAGE_PATH:
+            return MockResponse(body='<form><input name="loginName"/></form>', content_type='text/html')
+        if path not in self.routes:
+            return MockResponse(status=404, body='not found', content_type='text/plain')
+        name, handler = self.routes[path]
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return MockResponse(status=503, body='service unavailable', content_type='text/plain')
+        if name == 'login':
+            return handler(params)
+        # auth='elsSign' 只认参数里的会话号(同名参数取第一个)，不看cookie，用来检验重新登录后的重放
+        session_id = params.get('elsSign') if self.auth == 'elsSign' else \
+            cookies.get('eln_session_id') or params.get('elsSign')
+        username = self._session_user(session_id)
+        if username is None:
+            self.counts['expired'] = self.counts.get('expired', 0) + 1
+            return MockResponse(status=302, location=LOGIN_PAGE_PATH)
+        return handler(username, params)
+
+    def _session_user(self, session_id):
+        if session_id not in self.sessions:
+            return None
+        username, login_time = self.sessions[session_id]
+        if self.session_ttl and study_robot.clock.time() - login_time > self.session_ttl:
+            del self.sessions[session_id]
+            return None
+        return username
+
+    def _course_ids(self):
+        return [f'course{i:04d}' for i in range(self.courses)]
+
+    def _sco_ids(self, course_id):
+        return [f'{course_id}-sco{i:02d}' for i in range(self.scos)]
+
+    def _done(self, username, course_id, sco_id):
+        return self.progress.get((username, course_id, sco_id), 0) >= self.saves_per_sco
+
+    def login(self, params):
+        if not params.get('loginName') or not params.get('password'):
+            return MockResponse.json({'status': 'failed', 'message': 'missing credentials'})
+        session_id = f'elnSessionId.{uuid.uuid4().hex}'
+        self.sessions[session_id] = (params['loginName'], study_robot.clock.time())
+        return MockResponse.json({'status': 'success'}, cookies={'eln_session_id': session_id})
+
+    def course_center(self, username, params):
+        page_size = int(params.get('page.pageSize', 12))
+        page_no = int(params.get('page.pageNo', 1))
+        rows = []
+        for index, course_id in enumerate(self._course_ids()):
+            done = sum(self._done(username, course_id, sco_id) for sco_id in self._sco_ids(course_id))
+            rows.append({
+                'courseId': course_id,
+                'courseName': f'Course {index}',
+                'studyScore': 1 + index % 4,
+                'courseTime': self.scos * 10 * (1 + index % 3),
+                'studyProgress': int(100 * done / self.scos),
+                'getScoreTime': study_robot.clock.strftime('%Y-%m-%d %H:%M:%S') if done == self.scos else None
+            })
+        return MockResponse.json({'total': len(rows), 'rows': rows[(page_no - 1) * page_size:page_no * page_size]})
+
+    def page(self, username, params):
+        return MockResponse(body='<html><body>course</body></html>', content_type='text/html')
+
+    def course_item(self, username, params):
+        course_id = params.get('courseId', '')
+        scos = [(sco_id, f'Section {i + 1}', self._done(username, course_id, sco_id))
+                for i, sco_id in enumerate(self._sco_ids(course_id))]
+        if self.tree_format == 'json':
+            children = [{'id': sco_id, 'text': name, 'isComplete': 'true' if done else 'false'}
+                        for sco_id, name, done in scos]
+            return MockResponse.json([{'id': course_id, 'text': course_id,
+                                       'children': [{'id': f'{course_id}-chapter', 'text': 'Chapter 1',
+                                                     'children': children}]}])
+        parts = [f'<ol>\n<li class="cl-catalog-item" data-id="{course_id}-chapter">\n'
+                 f'<span class="cl-catalog-title" title="Chapter 1">Chapter 1</span>\n']
+        for i, (sco_id, name, done) in enumerate(scos):
+            state = 'item-done cl-catalog-link-done' if done else 'item-no'
+            parts.append(f'<div class="cl-catalog-item-sub">\n<a href="javascript:;" data-id="{sco_id}" '
+                         f'title="{name}" class="scormItem-no cl-catalog-link cl-catalog-link-sub\n{state}">'
+                         f'<span class="cl-catalog-icon"></span>({i + 1})&nbsp;{name}\n</a>\n</div>\n')
+        parts.append('</li>\n</ol>')
+        parts.append(self._tree_tail)
+        return MockResponse(body=''.join(parts), content_type='text/html')
+
+    def select_resource(self, username, params):
+        key = (username, params.get('courseId'), params.get('scoId'))
+        saves = self.progress.get(key, 0)
+        return MockResponse.json({'location': str(saves * 180.0),
+                                  'isComplete': 'true' if saves >= self.saves_per_sco else 'false'})
+
+    def select_check(self, username, params):
+        return MockResponse.json({'success': True})
+
+    def save_progress(self, username, params):
+        course_id = params.get('courseId')
+        key = (username, course_id, params.get('scoId'))
+        self.progress[key] = self.progress.get(key, 0) + 1
+        done = sum(self._done(username, course_id, sco_id) for sco_id in self._sco_ids(course_id))
+        rate = int(100 * done / self.scos)
+        return MockResponse.json({'courseProgress': rate, 'completeRate': rate,
+                                  'completed': 'true' if self.progress[key] >= self.saves_per_sco else 'false'})
+
+    def update_timestep(self, username, params):
+        return MockResponse(body='ok', content_type='text/plain')
+
+    def heartbeat(self, username, params):
+        return MockResponse.json({'success': True})
+
+class StubHttpClient(HttpClient):
+    """HttpClient that calls a MockTenant in-process instead of opening sockets."""
+    def __init__(self, pool, tenant):
+        super().__init__(pool)
+        self.tenant = tenant
+        self.cookies = {}
+
+    async def close(self):
+        pass
+
+    def clear_cookies(self):
+        self.cookies.clear()
+
+    def get_session_id(self):
+        return self.cookies.get('eln_session_id')
+
+    async def _send_once(self, method, api, params, headers):
+        parts = urlsplit(api)
+        params = first_values(itertools.chain(parse_qsl(parts.query, keep_blank_values=True),
+                                              self._prepare(params).items()))
+        result = await self.tenant.handle(method, parts.path, params, self.cookies)
+        self.cookies.update(result.cookies)
+        redirected = False
+        if result.location:
+            redirected = True
+            api = f'{parts.scheme}://{parts.netloc}{result.location}'
+            result = await self.tenant.handle('GET', result.location, {}, self.cookies)
+        return Response(result.status, {'Content-Type': result.content_type}, result.body, api, redirected)
+
+class StubPool(ConnectionPool):
+    """ConnectionPool whose clients talk to a MockTenant in-process."""
+    def __init__(self, tenant, **kwargs):
+        super().__init__(**kwargs)
+        self.tenant = tenant
+
+    def new_client(self):
+        return StubHttpClient(self, self.tenant)
+
+    async def close(self):
+        pass
+
+def first_values(pairs):
+    # 同名参数取第一个(先查询串后表单)，和读第一个值的服务器一样
+    params = {}
+    for key, value in pairs:
+        params.setdefault(key, value)
+    return params
+
+def make_app(tenant):
+    async def dispatch(request):
+        pairs = list(request.query.items())
+        if request.method == 'POST':
+            pairs.extend((await request.post()).items())
+        params = first_values(pairs)
+        result = await tenant.handle(request.method, request.path, params, request.cookies)
+        if result.location:
+            raise web.HTTPFound(result.location)
+        response = web.Response(status=result.status, text=result.body, content_type=result.content_type)
+        for key, value in result.cookies.items():
+            response.set_cookie(key, value)
+        return response
+
+    async def stats(request):
+        return web.json_response(tenant.counts)
+
+    app = web.Application()
+    app.router.add_get('/_stats', stats)
+    app.router.add_route('*', '/{tail:.*}', dispatch)
+    return app
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local 21tb stand-in server')
+    parser.add_argument('--port', type=int, default=8021)
+    parser.add_argument('--config', default=None, help='config file whose [api] section defines the routes')
+    parser.add_argument('--courses', type=int, default=20)
+    parser.add_argument('--scos', type=int, default=4)
+    parser.add_argument('--saves-per-sco', type=int, default=3, help='save_progress calls until a sco completes')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean response latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--session-ttl', type=float, default=0, help='seconds until a session expires, 0 never')
+    parser.add_argument('--tree', choices=['html', 'json'], default='html')
+    parser.add_argument('--auth', choices=['cookie', 'elsSign'], default='cookie',
+                        help="how requests are authenticated; elsSign ignores the session cookie")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = ConfigManager(args.config)
+    config.initialize()
+    tenant = MockTenant(config, courses=args.courses, scos=args.scos, saves_per_sco=args.saves_per_sco,
+                        latency=args.latency, error_rate=args.error_rate, session_ttl=args.session_ttl,
+                        tree_format=args.tree, auth=args.auth)
+    log(f'Mock 21tb listening on http://127.0.0.1:{args.port}')
+    web.run_app(make_app(tenant), host='127.0.0.1', port=args.port, print=None)
+
+if __name__ == '__main__':
+    main()
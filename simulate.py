@@ -0,0 +1,92 @@
+"""Time-virtualized simulation of the whole fleet against an in-process mock.
+
+Runs N accounts at the real 180 s cadence on a VirtualTimeLoop, so hours of
+studying finish in seconds. Used for capacity planning and for checking that
+scheduling stays fair across sessions:
+
+    python simulate.py --accounts 2000 --courses 3 --scos 4
+"""
+import os
+import time
+import argparse
+import tempfile
+import contextlib
+from bench_e2e import write_config, percentile
+from mock_server import MockTenant, StubPool
+from study_robot import INFO, ConfigManager, FleetRunner, SimulatedClock, VirtualTimeLoop, log_writer, set_clock
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Simulated-time fleet run against an in-process mock')
+    parser.add_argument('--accounts', type=int, default=1000)
+    parser.add_argument('--courses', type=int, default=3)
+    parser.add_argument('--scos', type=int, default=4)
+    parser.add_argument('--saves-per-sco', type=int, default=3)
+    parser.add_argument('--max-courses', type=int, default=3)
+    parser.add_argument('--per-host-limit', type=int, default=100)
+    parser.add_argument('--time-step', type=float, default=180)
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated server latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--session-ttl', type=float, default=0)
+    parser.add_argument('--tree', choices=['html', 'json'], default='html')
+    parser.add_argument('--verbose', action='store_true', help='keep the bot log on stdout')
+    args = parser.parse_args(argv)
+    args.port = 0  # 只用于生成配置中的 host，模拟时不会真的连接
+    return args
+
+def jain_index(values):
+    # 1.0 表示所有会话进度完全均衡
+    values = [v for v in values if v > 0]
+    if not values:
+        return 0.0
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+def main(argv=None):
+    args = parse_args(argv)
+    set_clock(SimulatedClock())
+    loop = VirtualTimeLoop()
+    with tempfile.TemporaryDirectory() as work_dir:
+        config_path = write_config(args, work_dir)
+        config = ConfigManager(config_path)
+        config.initialize()
+        tenant = MockTenant(config, courses=args.courses, scos=args.scos, saves_per_sco=args.saves_per_sco,
+                            latency=args.latency, error_rate=args.error_rate, session_ttl=args.session_ttl,
+                            tree_format=args.tree)
+        runner = FleetRunner(config_path, pool=StubPool.from_config(config, tenant=tenant))
+        if args.verbose:
+            log_writer.level = INFO
+        real_start = time.perf_counter()
+        cpu_start = time.process_time()
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                devnull = stack.enter_context(open(os.devnull, 'w'))
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+            loop.run_until_complete(runner.run())
+            log_writer.flush()
+        real = time.perf_counter() - real_start
+        cpu = time.process_time() - cpu_start
+        virtual = loop.time()
+        loop.close()
+
+    scos_done = {}
+    for (username, _, _), saves in tenant.progress.items():
+        if saves >= args.saves_per_sco:
+            scos_done[username] = scos_done.get(username, 0) + 1
+    finished = [bot for bot in runner.bots if bot.finished_at is not None]
+    durations = [bot.finished_at - bot.started_at for bot in finished]
+    throughput = [scos_done.get(bot.account['username'], 0) / max(d, 1e-9) for bot, d in zip(finished, durations)]
+    requests = sum(v for k, v in tenant.counts.items() if k != 'expired')
+    print(f'accounts:              {args.accounts} ({args.courses} courses x {args.scos} scos each)')
+    print(f'virtual time:          {virtual:.0f}s ({virtual / 3600:.2f}h)')
+    print(f'real time:             {real:.2f}s (speedup {virtual / max(real, 1e-9):.0f}x, CPU {cpu:.2f}s)')
+    print(f'scos completed:        {sum(scos_done.values())} / {args.accounts * args.courses * args.scos}')
+    print(f'requests:              {requests} ({requests / args.accounts:.1f} per account, '
+          f'{requests / max(virtual, 1e-9):.1f} per virtual second)')
+    print(f'CPU per session:       {cpu / args.accounts * 1000:.2f} ms')
+    print(f'session duration p50/p99/max: {percentile(durations, 0.5):.0f} / {percentile(durations, 0.99):.0f} / '
+          f'{max(durations, default=0):.0f} s')
+    print(f'fairness (Jain):       {jain_index(throughput):.3f}')
+    print('requests by endpoint:  ' + ', '.join(f'{k}={v}' for k, v in sorted(tenant.counts.items())))
+    print(f'HTTP stats:            {runner.pool.stats}')
+
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,590 @@
 import os
 import sys
+import csv
 import json
+import zlib
 import time
+import heapq
+import random
+import re
+import string
+import functools
+import argparse
+import asyncio
+import queue
+import atexit
+import sqlite3
+import logging
+import cProfile
+import threading
+import multiprocessing
+import collections
+import itertools
 import datetime
-import requests
+import aiohttp
+import contextvars
 import configparser
+from types import MappingProxyType
+from urllib.parse import quote, urlsplit
 import traceback
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
 
 CONFIG_FILE_NAME = "main.conf"
 
-def log(info):
-    print(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()), info)
-    sys.stdout.flush()
+class Clock:
+    """Wall clock used by the bot; swapped for a SimulatedClock in simulations."""
+    def time(self):
+        return time.time()
 
-class HttpClient:
+    def monotonic(self):
+        return time.monotonic()
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+    def strftime(self, fmt):
+        return time.strftime(fmt, time.localtime(self.time()))
+
+class SimulatedClock(Clock):
+    """Clock that follows the event loop's time, for use with VirtualTimeLoop."""
+    def __init__(self, start=None):
+        self.start = time.time() if start is None else start
+
+    def monotonic(self):
+        try:
+            return asyncio.get_running_loop().time()
+        except RuntimeError:
+            return 0.0
+
+    def time(self):
+        return self.start + self.monotonic()
+
+class _VirtualSelector:
+    def __init__(self, selector, loop):
+        self._selector = selector
+        self._loop = loop
+
+    def select(self, timeout=None):
+        # 没有就绪事件时直接跳到下一个定时器，而不是真的等待
+        events = self._selector.select(0 if timeout is not None else None)
+        if not events and timeout:
+            self._loop.virtual_now += timeout
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop whose time only advances when every task is waiting on a timer.
+
+    Sleeps cost no real time, so only in-process I/O (see mock_server.StubPool)
+    may be used on it; real sockets would see their timeouts fire instantly.
+    """
     def __init__(self):
-        self.session = requests.Session()
-        self.eln_session_id = None
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/48.0.2564.116 Safari/537.36',
-            'X-Requested-With': 'XMLHttpRequest',
+        super().__init__()
+        self.virtual_now = 0.0
+        self._selector = _VirtualSelector(self._selector, self)
+
+    def time(self):
+        return self.virtual_now
+
+clock = Clock()
+
+def set_clock(new_clock):
+    global clock
+    clock = new_clock
+
+class Metrics:
+    """In-process counters, gauges and latency histograms.
+
+    Rendered as Prometheus text or as a JSON snapshot by MetricsExporter.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.counters = collections.defaultdict(float)
+        self.gauges = collections.defaultdict(float)
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        self.counters[self._key(name, labels)] += value
+
+    def add(self, name, value, **labels):
+        self.gauges[self._key(name, labels)] += value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = {'buckets': [0] * (len(self.BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+        for index, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                break
+        else:
+            index = len(self.BUCKETS)
+        histogram['buckets'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+    @staticmethod
+    def _escape(value):
+        # Prometheus 文本格式要求标签值里的 \、换行和双引号转义，用户名、异常名里都可能出现
+        return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+    @classmethod
+    def _labels(cls, labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{cls._escape(v)}"' for k, v in pairs) + '}'
+
+    def render_prometheus(self):
+        lines = []
+        for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+            typed = set()
+            for (name, labels), value in sorted(series.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name}{self._labels(labels)} {value:g}')
+        typed = set()
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ('+Inf',), histogram['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{self._labels(labels)} {histogram["sum"]:g}')
+            lines.append(f'{name}_count{self._labels(labels)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        def series(items):
+            return [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(items)]
+        return {
+            'time': clock.time(),
+            'counters': series(self.counters.items()),
+            'gauges': series(self.gauges.items()),
+            'histograms': series(self.histograms.items()),
         }
 
+metrics = Metrics()
+
+# 当前协程所属的账号和课程，用于多账号模式下区分日志
+current_account = contextvars.ContextVar('current_account', default=None)
+current_course = contextvars.ContextVar('current_course', default=None)
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+class RotatingFile:
+    """Append-only file that rolls over to .1 .. .N once it reaches max_bytes."""
+    def __init__(self, path, max_bytes, backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.stream = open(path, 'a', encoding='utf-8')
+
+    def write(self, text):
+        if self.max_bytes and self.stream.tell() + len(text) > self.max_bytes:
+            self._rotate()
+        self.stream.write(text)
+        self.stream.flush()
+
+    def _rotate(self):
+        self.stream.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{index}'):
+                os.replace(f'{self.path}.{index}', f'{self.path}.{index + 1}')
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
+        self.stream = open(self.path, 'w', encoding='utf-8')
+
+    def close(self):
+        self.stream.close()
+
+class LogWriter:
+    """Queue-backed log sink.
+
+    Callers only check the level and enqueue; a background thread formats
+    records and writes them in batches, one write and flush per batch, to
+    stdout and/or a size-rotated file, as text or JSON lines.
+    """
+    def __init__(self, batch_size=256):
+        self.level = INFO
+        self.json = False
+        self.to_stdout = True
+        self.file = None
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+
+    def configure(self, level='info', fmt='text', path=None, max_bytes=0, backups=5, to_stdout=True):
+        if isinstance(level, str):
+            # getLevelName 对未知级别返回字符串 'Level XXX'，之后每次比较都会出错，这里直接拒绝
+            if level.lower() not in self.LEVELS:
+                raise Exception(f"Invalid [log] level '{level}', expected one of {'/'.join(self.LEVELS)}")
+            level = self.LEVELS[level.lower()]
+        self.flush()
+        self.level = level
+        self.json = fmt == 'json'
+        self.to_stdout = to_stdout
+        if self.file is not None:
+            self.file.close()
+        self.file = RotatingFile(path, max_bytes, backups) if path else None
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def emit(self, level, info, fields):
+        self._ensure_thread()
+        self._queue.put((clock.time(), level, str(info), fields))
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def _format(self, record):
+        ts, level, info, fields = record
+        if self.json:
+            entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(ts)),
+                     'level': logging.getLevelName(level).lower(), **fields, 'msg': info}
+            return json.dumps(entry, ensure_ascii=False) + '\n'
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+        if fields.get('account'):
+            return f'{stamp} [{fields["account"]}] {info}\n'
+        return f'{stamp} {info}\n'
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            text = ''.join(self._format(r) for r in batch if isinstance(r, tuple))
+            if text:
+                try:
+                    if self.to_stdout:
+                        sys.stdout.write(text)
+                        sys.stdout.flush()
+                    if self.file is not None:
+                        self.file.write(text)
+                except Exception:
+                    pass  # 日志写失败不影响学习
+            for r in batch:
+                if isinstance(r, threading.Event):
+                    r.set()
+
+    def flush(self):
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(5)
+
+log_writer = LogWriter()
+
+def log(info, level=INFO):
+    if level < log_writer.level:
+        return
+    fields = {}
+    account = current_account.get()
+    if account:
+        fields['account'] = account
+        course = current_course.get()
+        if course:
+            fields['course'] = course
+    log_writer.emit(level, info, fields)
+
+def debug(info):
+    log(info, DEBUG)
+
+def debug_enabled():
+    return log_writer.enabled(DEBUG)
+
+class Response:
+    """Fully read HTTP response, so callers never hold a connection open."""
+    def __init__(self, status_code, headers, text, url='', redirected=False):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+        self.url = url
+        self.redirected = redirected
+
+    def json(self):
+        return json.loads(self.text)
+
+class CircuitBreaker:
+    """Per-host breaker: after `threshold` consecutive failures requests wait
+    instead of hitting the host; after `reset_timeout` one probe request is let
+    through and, if it succeeds, every waiter resumes at once."""
+    def __init__(self, host, threshold, reset_timeout, stats):
+        self.host = host
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.stats = stats
+        self.failures = 0
+        self.opened_at = None
+        self.probe_at = None
+        self._closed = asyncio.Event()
+        self._closed.set()
+
+    async def acquire(self):
+        while self.opened_at is not None:
+            now = clock.monotonic()
+            wait = self.opened_at + self.reset_timeout - now
+            # 探测请求卡住太久时允许下一个请求接替探测
+            if wait <= 0 and (self.probe_at is None or now - self.probe_at > self.reset_timeout):
+                self.probe_at = now
+                return
+            self.stats['breaker_waits'] += 1
+            try:
+                await asyncio.wait_for(self._closed.wait(), max(wait, 0) or self.reset_timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def record_success(self):
+        self.failures = 0
+        if self.opened_at is not None:
+            log(f'Circuit breaker for {self.host} closed')
+            self.opened_at = None
+            self.probe_at = None
+            self._closed.set()
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None:
+            # 探测失败，重新计时
+            self.opened_at = clock.monotonic()
+            self.probe_at = None
+        elif self.failures >= self.threshold:
+            self.stats['breaker_trips'] += 1
+            metrics.inc('http_breaker_trips_total', host=self.host)
+            log(f'Circuit breaker for {self.host} opened after {self.failures} failures')
+            self.opened_at = clock.monotonic()
+            self._closed.clear()
+
+class ConnectionPool:
+    """Keep-alive transport shared by every account in the process.
+
+    Besides the connector it owns the timeouts, the retry policy and the
+    per-host circuit breakers, so limits apply across all accounts.
+    """
+    def __init__(self, per_host_limit=10, total_limit=0, keepalive_timeout=30, connect_timeout=10,
+                 read_timeout=30, max_retries=3, backoff_base=1.0, backoff_max=30.0,
+                 breaker_threshold=5, breaker_reset=30):
+        self.per_host_limit = per_host_limit
+        self.total_limit = total_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.breakers = {}
+        self.stats = {'retries': 0, 'breaker_trips': 0, 'breaker_waits': 0}
+        self.connector = None
+
     @classmethod
-    def get_instance(cls):
-        if not hasattr(cls, "_instance"):
-            cls._instance = cls()
-        return cls._instance
+    def from_config(cls, config, **kwargs):
+        return cls(**kwargs,
+                   per_host_limit=config.get_int('engine', 'per_host_limit', 10),
+                   total_limit=config.get_int('engine', 'pool_size', 0),
+                   keepalive_timeout=config.get_int('engine', 'keepalive_timeout', 30),
+                   connect_timeout=config.getfloat('http', 'connect_timeout', 10),
+                   read_timeout=config.getfloat('http', 'read_timeout', 30),
+                   max_retries=config.get_int('http', 'max_retries', 3),
+                   backoff_base=config.getfloat('http', 'backoff_base', 1.0),
+                   backoff_max=config.getfloat('http', 'backoff_max', 30.0),
+                   breaker_threshold=config.get_int('http', 'breaker_threshold', 5),
+                   breaker_reset=config.getfloat('http', 'breaker_reset', 30))
+
+    def new_client(self):
+        return HttpClient(self)
+
+    def get_breaker(self, url):
+        return self.host_breaker(url_host(url))
+
+    def host_breaker(self, host):
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(host, self.breaker_threshold, self.breaker_reset, self.stats)
+        return self.breakers[host]
+
+    def backoff(self, attempt):
+        # 指数退避 + 全抖动
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def get_connector(self):
+        # aiohttp connectors must be created inside the running event loop
+        if self.connector is None:
+            self.connector = aiohttp.TCPConnector(limit=self.total_limit,
+                                                  limit_per_host=self.per_host_limit,
+                                                  keepalive_timeout=self.keepalive_timeout)
+        return self.connector
+
+    async def close(self):
+        if self.connector is not None:
+            await self.connector.close()
+            self.connector = None
+
+# 连接阶段的错误：请求还没有发到服务器
+CONNECT_ERRORS = (aiohttp.ClientConnectorError,) + \
+    ((aiohttp.ConnectionTimeoutError,) if hasattr(aiohttp, 'ConnectionTimeoutError') else ())
+
+class HttpClient:
+    HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/48.0.2564.116 Safari/537.36',
+        'X-Requested-With': 'XMLHttpRequest',
+    }
+
+    def __init__(self, pool):
+        self.session = None
+        self.pool = pool
+        self.session_manager = None
+        self.eln_session_id = None
+        self.headers = self.HEADERS
+        self._prepared = {}
+        self._prepared_session = None
+
+    def _get_session(self):
+        # 每个账号独立的cookie jar，连接池由所有账号共享；公共请求头在会话上设置一次，请求只带额外的头
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=self.pool.get_connector(), connector_owner=False,
+                                                 cookie_jar=aiohttp.CookieJar(unsafe=True), timeout=self.pool.timeout,
+                                                 headers=self.headers)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def clear_cookies(self):
+        if self.session is not None:
+            self.session.cookie_jar.clear()
 
     def get_session_id(self):
-        return self.session.cookies.get('eln_session_id')
+        if self.session is None:
+            return None
+        for cookie in self.session.cookie_jar:
+            if cookie.key == 'eln_session_id':
+                return cookie.value
+        return None
 
-    def post(self, api, params=None):
-        if not params:
-            params = {'elsSign': self.get_session_id()}
-        else:
-            params.update({'elsSign': self.get_session_id()})
-        response = self.session.post(api, params, headers=self.headers)
-        
-        if response.status_code != 200:
-            log(f"HTTP POST request to {api} failed with status code {response.status_code}")
-        
+    def _route(self, api):
+        """Circuit breaker and metrics label for a request URL; EndpointUrl carries both precomputed."""
+        if api.__class__ is EndpointUrl:
+            return self.pool.host_breaker(api.host), api.label
+        return self.pool.get_breaker(api), endpoint_label(api)
+
+    ELS_SIGN_QUERY = re.compile(r'([?&]elsSign=)[^&#]*')
+
+    def _with_session(self, api):
+        session_id = self.get_session_id()
+        if api.__class__ is EndpointUrl:
+            return api.with_session(session_id)
+        return self.ELS_SIGN_QUERY.sub(lambda m: m.group(1) + quote(session_id or '', safe=''), api)
+
+    @staticmethod
+    def _form(params, session_id):
+        # requests silently dropped None values, aiohttp refuses them; one pass builds the form and adds elsSign
+        prepared = {k: v if v.__class__ is str else str(v) for k, v in params.items() if v is not None}
+        if session_id is not None:
+            prepared['elsSign'] = session_id
+        return prepared
+
+    def _prepare(self, params):
+        session_id = self.get_session_id()
+        if params is None or params.__class__ is MappingProxyType:
+            # 无参数或常量参数(只读映射)的表单只随会话变化：每个会话整理一次，之后直接复用
+            if session_id != self._prepared_session:
+                self._prepared.clear()
+                self._prepared_session = session_id
+            key = id(params)
+            prepared = self._prepared.get(key)
+            if prepared is None:
+                prepared = self._prepared[key] = self._form(params or {}, session_id)
+            return prepared
+        return self._form(params, session_id)
+
+    async def post(self, api, params=None, relogin=True, idempotent=False):
+        return await self._request('POST', api, params, None, relogin, idempotent)
+
+    async def get(self, api, params=None, headers=None, relogin=True):
+        return await self._request('GET', api, params, headers, relogin, True)
+
+    async def _request(self, method, api, params, headers, relogin, idempotent):
+        sessions = self.session_manager if relogin else None
+        if sessions is None:
+            return await self._send(method, api, params, headers, idempotent)
+        await sessions.ensure_fresh()
+        generation = sessions.generation
+        response = await self._send(method, api, params, headers, idempotent)
+        if sessions.is_expired(response):
+            log(f"Session expired while requesting {api}")
+            await sessions.login(generation)
+            # 重新登录后用新的 elsSign 重放请求；URL里带的旧会话号也要换掉，否则服务器读到的还是旧的
+            response = await self._send(method, self._with_session(api), params, headers, idempotent)
         return response
 
-    def get(self, api):
-        response = self.session.get(api, params={'elsSign': self.get_session_id()}, headers=self.headers)
-        
-        if response.status_code != 200:
-            log(f"HTTP GET request to {api} failed with status code {response.status_code}")
-        
+    async def _send(self, method, api, params, headers, idempotent):
+        breaker, endpoint = self._route(api)
+        attempts = self.pool.max_retries + 1
+        for attempt in range(attempts):
+            await breaker.acquire()
+            start = clock.monotonic()
+            try:
+                response = await self._send_once(method, api, params, headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.inc('http_errors_total', endpoint=endpoint, kind=type(e).__name__)
+                breaker.record_failure()
+                # 非幂等请求只在连接没建立(请求肯定没发出)时重试
+                if attempt + 1 >= attempts or not (idempotent or isinstance(e, CONNECT_ERRORS)):
+                    raise
+                log(f"HTTP {method} request to {api} failed: {e!r}, retrying", WARNING)
+            else:
+                metrics.observe('http_request_duration_seconds', clock.monotonic() - start, endpoint=endpoint)
+                metrics.inc('http_requests_total', endpoint=endpoint, status=response.status_code)
+                if response.status_code < 500:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if attempt + 1 >= attempts or not idempotent:
+                    return response
+            self.pool.stats['retries'] += 1
+            metrics.inc('http_retries_total', endpoint=endpoint)
+            await clock.sleep(self.pool.backoff(attempt))
+
+    async def _send_once(self, method, api, params, headers):
+        params = self._prepare(params)
+        if method == 'GET':
+            request = self._get_session().get(api, params=params, headers=headers)
+        else:
+            request = self._get_session().post(api, data=params, headers=headers)
+        async with request as resp:
+            response = Response(resp.status, resp.headers, await resp.text(), str(resp.url), bool(resp.history))
+
+        if response.status_code not in (200, 304):
+            log(f"HTTP {method} request to {api} failed with status code {response.status_code}", WARNING)
+
         return response
 
     @staticmethod
@@ -57,63 +592,855 @@ class HttpClient:
         try:
             return response.json()
         except json.JSONDecodeError:
-            log(f"Failed to decode JSON. Response content: {response.text[:200]}...")
+            log(f"Failed to decode JSON. Response content: {response.text[:200]}...", WARNING)
             return None
 
+def url_host(url):
+    # 'scheme://host/path' 直接切分，其他形式交给 urlsplit
+    parts = url.split('/', 3)
+    if len(parts) >= 3 and parts[1] == '' and parts[0].endswith(':'):
+        return parts[2]
+    return urlsplit(url).netloc
+
+def endpoint_label(url):
+    """Last path segment of a request URL, used as the metrics label."""
+    return url.split('?', 1)[0].rsplit('/', 1)[-1]
+
+class SessionManager:
+    """Keeps one account logged in.
+
+    Expired sessions are spotted from the response; the first caller to see
+    one logs in again and every concurrent caller waits on that same login
+    instead of starting its own. With a ttl the session is also refreshed
+    before the server would expire it.
+    """
+    LOGIN_FORM_MARKERS = ('name="loginName"', "name='loginName'", 'name=loginName')
+
+    def __init__(self, login, ttl=0):
+        self._login = login
+        self.ttl = ttl
+        self.generation = 0
+        self.logged_in_at = None
+        self.relogins = 0
+        self._inflight = None
+
+    @staticmethod
+    def is_expired(response):
+        if response.status_code in (401, 403):
+            return True
+        # 会话失效时接口会被重定向到登录页
+        if response.redirected and 'login' in response.url.lower():
+            return True
+        # 未跟随重定向时登录页直接返回：只认登录表单的输入框，页面里其他提到 loginName 的地方不算
+        head = response.text[:4096]
+        return any(marker in head for marker in SessionManager.LOGIN_FORM_MARKERS)
+
+    async def login(self, generation=None):
+        if generation is not None and generation != self.generation:
+            return  # 其他请求已经重新登录过
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._do_login())
+        inflight = self._inflight
+        await asyncio.shield(inflight)
+
+    async def _do_login(self):
+        try:
+            if self.logged_in_at is not None:
+                self.relogins += 1
+                metrics.inc('relogins_total')
+                log(f'Logging in again (relogin #{self.relogins})')
+            await self._login()
+            self.generation += 1
+            self.logged_in_at = clock.time()
+        finally:
+            self._inflight = None
+
+    async def ensure_fresh(self):
+        if self.ttl and self.logged_in_at is not None and clock.time() - self.logged_in_at > self.ttl:
+            log('Session is about to expire, refreshing')
+            await self.login(self.generation)
+
 class ConfigManager:
-    def __init__(self):
+    def __init__(self, config_file_path=None):
         self._config = None
-        self.work_dir = os.path.dirname(__file__)
-        self.config_file_path = os.path.join(self.work_dir, CONFIG_FILE_NAME)
+        if config_file_path is None:
+            config_file_path = os.path.join(os.path.dirname(__file__), CONFIG_FILE_NAME)
+        self.config_file_path = config_file_path
+        self.work_dir = os.path.dirname(config_file_path)
+        self._mtimes = {}
 
     def initialize(self):
         if not os.path.exists(self.config_file_path):
             raise Exception(f"Config file {self.config_file_path} is missing!")
-        self._config = configparser.ConfigParser()
-        read_ok = self._config.read(self.config_file_path, encoding='utf-8')
+        parser = configparser.ConfigParser()
+        read_ok = parser.read(self.config_file_path, encoding='utf-8')
         if self.config_file_path not in read_ok:
             raise Exception(f"Failed to load config file {self.config_file_path}")
+        if parser.has_section('api'):
+            # 启动(及重新加载)时就检查接口模板，有问题不替换当前配置
+            registry = EndpointRegistry(dict(parser.items('api')))
+            for name in registry.missing:
+                log(f'Warning: API:{name} is not configured')
+        # 整体替换，读到一半的配置不会被其他协程看到
+        self._config = parser
+        self._mtimes = self._stat()
         log(f"Loaded config {self.config_file_path}")
 
+    def _stat(self):
+        paths = [self.config_file_path]
+        accounts_file = self._config.get('main', 'accounts_file', fallback='') if self._config else ''
+        if accounts_file:
+            paths.append(os.path.join(self.work_dir, accounts_file))
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def changed(self):
+        """True when main.conf or the accounts file was modified since the last (re)load."""
+        return self._stat() != self._mtimes
+
+    def reload(self):
+        """Re-read the config and return its accounts; an invalid config is rejected and
+        the previous one stays in effect."""
+        previous = self._config
+        self._mtimes = self._stat()  # 坏配置只报一次错，文件再次修改后重试
+        try:
+            self.initialize()
+            return self.get_accounts()
+        except Exception:
+            self._config = previous
+            raise
+
+    def for_account(self, account):
+        return AccountConfig(self, account)
+
     def get_section_items(self, section):
         if self._config is not None:
             configs = self._config.items(section)
             return dict(configs)
         raise Exception("Config file not loaded")
 
-class StudyBot:
+    def get(self, section, key, default):
+        if self._config is None:
+            raise Exception("Config file not loaded")
+        return self._config.get(section, key, fallback=default)
+
+    def getboolean(self, section, key, default):
+        if self._config is None:
+            raise Exception("Config file not loaded")
+        return self._config.getboolean(section, key, fallback=default)
+
+    def get_int(self, section, key, default):
+        if self._config is None:
+            raise Exception("Config file not loaded")
+        return self._config.getint(section, key, fallback=default)
+
+    def getfloat(self, section, key, default):
+        if self._config is None:
+            raise Exception("Config file not loaded")
+        return self._config.getfloat(section, key, fallback=default)
+
+    def get_accounts(self):
+        """Collect accounts from [main], [account:*] sections and the optional accounts_file."""
+        if self._config is None:
+            raise Exception("Config file not loaded")
+        main_config = self.get_section_items('main')
+        default_corp_code = main_config.get('corpcode')
+        accounts = []
+        if main_config.get('username'):
+            accounts.append({'username': main_config['username'], 'password': main_config['password'],
+                             'corpcode': default_corp_code})
+        for section in self._config.sections():
+            if section.startswith('account:'):
+                account = self.get_section_items(section)
+                account.setdefault('username', section[len('account:'):])
+                account.setdefault('corpcode', default_corp_code)
+                accounts.append(account)
+        accounts_file = main_config.get('accounts_file')
+        if accounts_file:
+            path = os.path.join(self.work_dir, accounts_file)
+            for account in self._read_accounts_file(path):
+                account.setdefault('corpcode', default_corp_code)
+                accounts.append(account)
+
+        api_config = self.get_section_items('api') if self._config.has_section('api') else {}
+        unique = {}
+        for account in accounts:
+            if not account.get('username') or not account.get('password'):
+                raise Exception(f"Account {account.get('username')} is missing username or password")
+            # 账号覆盖的 [engine]/[plan]/[api] 项和全局配置一样在加载时校验，坏的账号配置整体拒绝
+            overrides = {key: value for key, value in account.items() if key in api_config}
+            try:
+                if overrides:
+                    EndpointRegistry({**api_config, **overrides})
+                StudyBot.check_config(self.for_account(account))
+            except Exception as e:
+                raise Exception(f"Account {account['username']}: {str(e)}")
+            unique.setdefault((account['corpcode'], account['username']), account)
+        return list(unique.values())
+
+    @staticmethod
+    def _read_accounts_file(path):
+        if not os.path.exists(path):
+            raise Exception(f"Accounts file {path} is missing!")
+        with open(path, encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                rows = [json.loads(line) for line in f if line.strip()]
+            else:
+                rows = list(csv.DictReader(f))
+        return [{k: str(v).strip() for k, v in row.items() if v} for row in rows]
+
+class AccountConfig:
+    """ConfigManager view for one account: keys set on the account ([account:*] section
+    or accounts file column) override [engine], [plan] and [api] keys of the same name."""
+    OVERRIDABLE = ('engine', 'plan', 'api')
+
+    def __init__(self, config, account):
+        self._base = config
+        self.account = account
+
+    def __getattr__(self, name):
+        return getattr(self._base, name)
+
+    def _override(self, section, key):
+        if section in self.OVERRIDABLE:
+            return self.account.get(key)
+        return None
+
+    def get_section_items(self, section):
+        items = self._base.get_section_items(section)
+        if section in self.OVERRIDABLE:
+            items.update((key, self.account[key]) for key in items if key in self.account)
+        return items
+
+    def get(self, section, key, default):
+        value = self._override(section, key)
+        return self._base.get(section, key, default) if value is None else value
+
+    def getboolean(self, section, key, default):
+        value = self._override(section, key)
+        if value is None:
+            return self._base.getboolean(section, key, default)
+        return configparser.ConfigParser.BOOLEAN_STATES[str(value).lower()]
+
+    def get_int(self, section, key, default):
+        value = self._override(section, key)
+        return self._base.get_int(section, key, default) if value is None else int(value)
+
+    def getfloat(self, section, key, default):
+        value = self._override(section, key)
+        return self._base.getfloat(section, key, default) if value is None else float(value)
+
+class CatalogParser(HTMLParser):
+    """Streams sco records out of the course catalog markup without building a DOM.
+
+    Yields the same records, in the same order, as selecting
+    '.cl-catalog-item-sub a' on a BeautifulSoup html.parser tree.
+    """
+    VOID_ELEMENTS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen',
+                               'link', 'menuitem', 'meta', 'param', 'source', 'track', 'wbr'])
+
     def __init__(self):
-        self.http = HttpClient.get_instance()
-        self.config = ConfigManager()
-        self.config.initialize()
+        super().__init__(convert_charrefs=True)
+        self.items = []
+        self._stack = []
+        self._sub_depth = 0
+
+    def _start(self, tag, attrs, self_closing):
+        classes = ()
+        for key, value in attrs:
+            if key == 'class':
+                classes = (value or '').split()
+        if tag == 'a' and self._sub_depth:
+            attrs = dict(attrs)
+            self.items.append({
+                'name': attrs.get('title') or '',
+                'scoId': attrs.get('data-id') or '',
+                'done': 'item-done' in classes or 'cl-catalog-link-done' in classes
+            })
+        if self_closing or tag in self.VOID_ELEMENTS:
+            return
+        is_sub = 'cl-catalog-item-sub' in classes
+        self._stack.append((tag, is_sub))
+        if is_sub:
+            self._sub_depth += 1
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        # 与 html.parser 建树一致：闭合到最近的同名标签，没有则忽略
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index][0] == tag:
+                for _, is_sub in self._stack[index:]:
+                    if is_sub:
+                        self._sub_depth -= 1
+                del self._stack[index:]
+                return
+
+class CourseTreeCache:
+    """Parsed course trees kept on disk as JSON lines, keyed by corpcode and courseId.
+
+    The file is append-only and replayed in order on load. A 'tree' record holds
+    the tree shared by every account of the corp. Done-state flags are kept per
+    account, because the catalog markup marks them for the logged-in user, and
+    are written as small 'done' (an account's full list) and 'sco' (one more sco)
+    records, so a write costs the same however many accounts share a course.
+    Once the file holds about twice the lines a rewrite needs, it is compacted.
+    """
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._entries = {}
+        self._file = None
+        self._lines = 0
+        self._compacted_lines = 0
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 写入中断留下的半行
+                self._apply(record)
+                self._lines += 1
+        self._compacted_lines = sum(1 + len(entry['done']) for entry in self._entries.values())
+        self._maybe_compact()
+        log(f"Loaded {len(self._entries)} cached course trees from {self.path}")
+
+    def _apply(self, record):
+        kind = record.get('kind')
+        key = record.get('key')
+        entry = self._entries.get(key)
+        if kind == 'tree':
+            # 目录更新时保留各账号的完成状态
+            self._entries[key] = {'key': key, 'fetched_at': record['fetched_at'], 'etag': record['etag'],
+                                  'last_modified': record['last_modified'], 'items': record['items'],
+                                  'done': entry['done'] if entry else {}}
+        elif entry is None:
+            return  # 对应的目录记录丢了(半行)，完成状态无处挂
+        elif kind == 'touch':
+            entry['fetched_at'] = record['fetched_at']
+        elif kind == 'done':
+            entry['done'][record['user']] = record['done']
+        elif kind == 'sco':
+            done = entry['done'].setdefault(record['user'], [])
+            if record['sco'] not in done:
+                done.append(record['sco'])
+
+    def _maybe_compact(self):
+        # 上次压缩后追加的行数超过当时的行数才重写，重写的开销摊到每次写入上是常数
+        if self.path and self._lines > 2 * self._compacted_lines + 64:
+            self._compact()
+
+    def _compact(self):
+        self.close()
+        lines = 0
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for key, entry in self._entries.items():
+                f.write(json.dumps({'kind': 'tree', 'key': key, 'fetched_at': entry['fetched_at'],
+                                    'etag': entry['etag'], 'last_modified': entry['last_modified'],
+                                    'items': entry['items']}, ensure_ascii=False) + '\n')
+                for user, done in entry['done'].items():
+                    f.write(json.dumps({'kind': 'done', 'key': key, 'user': user, 'done': done},
+                                       ensure_ascii=False) + '\n')
+                lines += 1 + len(entry['done'])
+        os.replace(tmp_path, self.path)
+        self._lines = self._compacted_lines = lines
+
+    def _write(self, record):
+        self._apply(record)
+        if not self.path:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self._lines += 1
+        self._maybe_compact()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def _key(corp_code, course_id):
+        return f'{corp_code}:{course_id}'
+
+    def get(self, corp_code, course_id):
+        return self._entries.get(self._key(corp_code, course_id))
+
+    def is_fresh(self, entry):
+        return clock.time() - entry['fetched_at'] < self.ttl
+
+    @staticmethod
+    def validators(entry):
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    @staticmethod
+    def items_for(entry, username):
+        done = set(entry['done'].get(username, []))
+        return [{'name': i['name'], 'scoId': i['scoId'], 'done': i['scoId'] in done} for i in entry['items']]
+
+    def put(self, corp_code, course_id, items_list, username, headers):
+        key = self._key(corp_code, course_id)
+        old = self._entries.get(key)
+        tree = {
+            'kind': 'tree',
+            'key': key,
+            'fetched_at': clock.time(),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'items': [{'name': i['name'], 'scoId': i['scoId']} for i in items_list]
+        }
+        if old is not None and all(old[field] == tree[field] for field in ('etag', 'last_modified', 'items')):
+            # 别的账号已经缓存过同样的目录，只刷新时间
+            self._write({'kind': 'touch', 'key': key, 'fetched_at': tree['fetched_at']})
+        else:
+            self._write(tree)
+        done = [i['scoId'] for i in items_list if i.get('done')]
+        if old is None or old['done'].get(username) != done:
+            self._write({'kind': 'done', 'key': key, 'user': username, 'done': done})
+
+    def mark_done(self, corp_code, course_id, username, sco_id):
+        key = self._key(corp_code, course_id)
+        entry = self._entries.get(key)
+        if entry is None or sco_id in entry['done'].get(username, []):
+            return
+        self._write({'kind': 'sco', 'key': key, 'user': username, 'sco': sco_id})
+
+    def touch(self, entry):
+        self._write({'kind': 'touch', 'key': entry['key'], 'fetched_at': clock.time()})
+
+class CheckpointStore:
+    """Last confirmed save_progress result per account, course and sco, in SQLite (WAL)."""
+    def __init__(self, path):
+        self.path = path
+        # 多进程模式下各 worker 共用同一个库，写锁冲突时等待而不是报错
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS checkpoint (
+            corp_code TEXT NOT NULL,
+            username TEXT NOT NULL,
+            course_id TEXT NOT NULL,
+            sco_id TEXT NOT NULL,
+            location REAL NOT NULL,
+            completed INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (corp_code, username, course_id, sco_id))''')
+        self.db.commit()
+
+    def record(self, account, course_id, sco_id, location, completed):
+        self.db.execute('INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (account['corpcode'], account['username'], course_id, sco_id,
+                         float(location), int(completed), clock.time()))
+        self.db.commit()
+
+    def load(self, account, course_id):
+        rows = self.db.execute('SELECT sco_id, location, completed FROM checkpoint '
+                               'WHERE corp_code = ? AND username = ? AND course_id = ?',
+                               (account['corpcode'], account['username'], course_id))
+        return {sco_id: (location, bool(completed)) for sco_id, location, completed in rows}
+
+    def close(self):
+        self.db.close()
+
+class Timer:
+    def __init__(self, interval, callback, args):
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.context = contextvars.copy_context()
+        self.cancelled = False
+        self.task = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    def cancel(self):
+        self.cancelled = True
+        # 正在执行的回调也一并取消，避免会话关闭后仍有请求在途
+        if self.task is not None and not self.task.done() and self.task is not asyncio.current_task():
+            self.task.cancel()
+        if not self.done.done():
+            self.done.cancel()
+
+class TimerScheduler:
+    """Heap of periodic timers driven by a single task.
+
+    A timer's callback is a coroutine function; it is fired every interval
+    (stretched by a random jitter so timers spread out) until it returns True,
+    which resolves timer.done.
+    """
+    def __init__(self, jitter=0.1):
+        self.jitter = jitter
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    def call_every(self, interval, callback, *args):
+        timer = Timer(interval, callback, args)
+        # first run lands somewhere in the jitter window instead of all at once
+        self._push(timer, random.uniform(0, self.jitter * interval))
+        return timer
+
+    async def close(self):
+        self._heap.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _push(self, timer, delay):
+        loop = asyncio.get_running_loop()
+        heapq.heappush(self._heap, (loop.time() + delay, next(self._seq), timer))
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._heap:
+            due, _, timer = self._heap[0]
+            if timer.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            delay = due - loop.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            # run the callback in the context of whoever created the timer
+            timer.task = timer.context.run(loop.create_task, self._fire(timer))
+
+    async def _fire(self, timer):
+        try:
+            finished = await timer.callback(*timer.args)
+        except Exception as e:
+            if not timer.done.done():
+                timer.done.set_exception(e)
+            return
+        if timer.cancelled:
+            return
+        if finished:
+            timer.done.set_result(True)
+        else:
+            self._push(timer, timer.interval * (1 + random.uniform(0, self.jitter)))
+
+class EndpointUrl(str):
+    """URL formatted from an Endpoint, carrying its host and metrics label so a request
+    doesn't split the URL again, and the values it was formatted with so it can be rebuilt."""
+
+    def with_session(self, session_id):
+        # 会话号写在URL里的接口(如 elsSign={session_id})在重新登录后要用新会话号重新生成
+        if 'session_id' not in self.endpoint.fields:
+            return self
+        return self.endpoint.format({**self.values, 'session_id': session_id})
+
+class Endpoint:
+    """One [api] URL, parsed once with string.Formatter into a template for str.format_map.
+
+    Legacy {courseId}/{scoId}, {0}/{1} and positional %s placeholders are mapped to
+    course_id/sco_id."""
+    ALIASES = {'courseId': 'course_id', 'scoId': 'sco_id', '0': 'course_id', '1': 'sco_id'}
+    POSITIONAL = ('course_id', 'sco_id')
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.label = endpoint_label(url)
+        self.host = url_host(url)
+        if '{' in self.host or '%s' in self.host:
+            raise Exception(f"API '{name}': placeholders are not allowed in the host of {url}")
+        template = url
+        if '%s' in url:
+            # 旧配置 select_check 的写法：select_check % (course_id, sco_id)
+            pieces = url.split('%s')
+            if '{' in url or len(pieces) - 1 > len(self.POSITIONAL):
+                raise Exception(f"API '{name}': '%s' placeholders can't be mixed with {{}} ones "
+                                f"or used more than {len(self.POSITIONAL)} times in {url}")
+            template = pieces[0].replace('}', '}}')
+            for field, piece in zip(self.POSITIONAL, pieces[1:]):
+                template += '{' + field + '}' + piece.replace('}', '}}')
+        chunks = []
+        fields = set()
+        try:
+            parsed = list(string.Formatter().parse(template))
+        except ValueError as e:
+            raise Exception(f"API '{name}' has a malformed URL template {url}: {str(e)}")
+        for literal, field, spec, conversion in parsed:
+            chunks.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field is None:
+                continue
+            if spec or conversion:
+                raise Exception(f"API '{name}': format specs are not supported in placeholder {{{field}}}")
+            field = self.ALIASES.get(field, field)
+            fields.add(field)
+            chunks.append('{' + field + '}')
+        self.fields = frozenset(fields)
+        self._template = ''.join(chunks)
+        self._static = self._wrap(url, None)
+
+    def _wrap(self, url, values):
+        url = EndpointUrl(url)
+        url.host = self.host
+        url.label = self.label
+        url.endpoint = self
+        url.values = values
+        return url
+
+    def format(self, values):
+        if not self.fields:
+            return self._static
+        return self._wrap(self._template.format_map(values), values)
+
+@functools.lru_cache(maxsize=None)
+def compile_endpoint(name, url):
+    return Endpoint(name, url)
+
+class EndpointRegistry:
+    """The [api] table compiled into Endpoints. Placeholders are validated up front against
+    the values each endpoint's caller supplies, so formatting a URL can't fail mid-study."""
+    NAMES = ('login', 'save_progress', 'course_item', 'select_resource', 'select_check',
+             'update_timestep', 'course_show', 'heartbeat', 'course_center', 'enter_course')
+    # 各接口调用处提供的占位符；未列出的接口只能使用 {session_id}
+    FIELDS = {
+        'login': frozenset(),
+        'course_item': frozenset(['course_id', 'session_id']),
+        'select_check': frozenset(['course_id', 'sco_id', 'session_id']),
+        'course_show': frozenset(['course_id', 'session_id']),
+        'enter_course': frozenset(['course_id', 'session_id']),
+    }
+    DEFAULT_FIELDS = frozenset(['session_id'])
+
+    def __init__(self, api_config):
+        host = api_config.get('host', '')
+        self.endpoints = {}
+        self.missing = []
+        for name in self.NAMES:
+            if name not in api_config:
+                self.missing.append(name)
+                continue
+            endpoint = compile_endpoint(name, f'{host}{api_config[name]}')
+            allowed = self.FIELDS.get(name, self.DEFAULT_FIELDS)
+            unknown = endpoint.fields - allowed
+            if unknown:
+                raise Exception(f"API '{name}' uses unknown placeholders {sorted(unknown)}, "
+                                f"allowed: {sorted(allowed) or 'none'}")
+            self.endpoints[name] = endpoint
+
+    def __getitem__(self, name):
+        return self.endpoints[name]
+
+    def __eq__(self, other):
+        return isinstance(other, EndpointRegistry) and \
+            {name: e.url for name, e in self.endpoints.items()} == \
+            {name: e.url for name, e in other.endpoints.items()}
+
+class CoursePlan:
+    """Orders course center rows by credit per remaining sco-minute and stops once the
+    courses picked cover what is left of the account's monthly credit target."""
+    def __init__(self, config):
+        self.score_field = config.get('plan', 'score_field', 'studyScore')
+        self.progress_field = config.get('plan', 'progress_field', 'studyProgress')
+        self.time_field = config.get('plan', 'time_field', 'courseTime')
+        self.score_time_field = config.get('plan', 'score_time_field', 'getScoreTime')
+        # config 为 AccountConfig 时，账号自己的 credit_target 优先于 [plan] 的默认值
+        self.target = config.getfloat('plan', 'credit_target', 0)
+        # 课时未知时按一个采集周期估算，避免除零且不让它排到最前
+        self.min_minutes = config.getfloat('engine', 'time_step', 180) / 60
+
+    def __eq__(self, other):
+        return isinstance(other, CoursePlan) and vars(self) == vars(other)
+
+    @staticmethod
+    def _number(value, default=0.0):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return default
+
+    def is_done(self, row):
+        return row.get(self.score_time_field) is not None
+
+    def credit(self, row):
+        return self._number(row.get(self.score_field))
+
+    def remaining_minutes(self, row):
+        progress = min(max(self._number(row.get(self.progress_field)), 0.0), 100.0)
+        minutes = self._number(row.get(self.time_field)) * (100.0 - progress) / 100
+        return max(minutes, self.min_minutes)
+
+    def density(self, row):
+        return self.credit(row) / self.remaining_minutes(row)
+
+    def _scored_this_month(self, row):
+        value = row.get(self.score_time_field)
+        if isinstance(value, (int, float)):
+            # 毫秒时间戳
+            value = time.strftime('%Y-%m', time.localtime(value / 1000))
+        return str(value).startswith(clock.strftime('%Y-%m'))
+
+    def earned(self, rows):
+        return sum(self.credit(row) for row in rows if self.is_done(row) and self._scored_this_month(row))
+
+    def order(self, preferred, rows):
+        """Course ids to study: study.list entries first, then center courses by density,
+        cut off once the target is covered (no cut-off when the target is 0)."""
+        by_id = {row['courseId']: row for row in rows if row.get('courseId')}
+        need = self.target - self.earned(rows) if self.target else float('inf')
+        plan = []
+        for course_id in preferred:
+            plan.append(course_id)
+            row = by_id.get(course_id)
+            if row is not None and not self.is_done(row):
+                need -= self.credit(row)
+        candidates = sorted((row for course_id, row in by_id.items()
+                             if course_id not in plan and not self.is_done(row)),
+                            key=self.density, reverse=True)
+        picked = []
+        while candidates and need > 0:
+            best = candidates[0]
+            # 差得不多时，能一门补足缺口的最短课程可能比按密度再学几门更省时间
+            covering = [row for row in candidates if self.credit(row) >= need]
+            closing = min(covering, key=self.remaining_minutes) if covering else None
+            if closing is not None and self.density(best) > 0 and \
+                    self.remaining_minutes(closing) <= need / self.density(best):
+                best = closing
+            candidates.remove(best)
+            picked.append(best)
+            need -= self.credit(best)
+        # 贪心可能多选：去掉超出目标仍可省下的课程，课时长的先去
+        for row in sorted(picked, key=self.remaining_minutes, reverse=True):
+            if self.credit(row) <= -need:
+                picked.remove(row)
+                need += self.credit(row)
+        return plan + [row['courseId'] for row in picked]
+
+    def describe(self, plan, rows):
+        by_id = {row['courseId']: row for row in rows if row.get('courseId')}
+        credit = sum(self.credit(by_id[c]) for c in plan if c in by_id)
+        minutes = sum(self.remaining_minutes(by_id[c]) for c in plan if c in by_id)
+        target = f'{self.target:g}' if self.target else '-'
+        return (f'Plan: {len(plan)} courses, {credit:g} credits, ~{minutes:.0f} min; '
+                f'earned this month {self.earned(rows):g}, target {target}')
+
+class StudyBot:
+    HEARTBEAT_PARAMS = MappingProxyType({'_ajax_toKen': 'os'})
+    # 课程中心最多翻的页数，防止服务器忽略页码或返回异常的总数时无休止地翻页
+    MAX_COURSE_PAGES = 100
+
+    def __init__(self, config, account, pool, scheduler, tree_cache, checkpoints):
+        self.config = config
+        self.account = account
+        self.scheduler = scheduler
+        self.tree_cache = tree_cache
+        self.checkpoints = checkpoints
+        self.plan = CoursePlan(config)
+        self.draining = False
+        self.course_queue = None
+        self.course_workers = set()
+        self.started_courses = set()
+        self._replan_task = None
+        settings = self.engine_settings(self.config)
+        self.max_courses = settings['max_courses']
+        self.max_scos = settings['max_scos']
+        self.time_step = settings['time_step']
+        self.course_page_size = settings['course_page_size']
+        self.course_page_fanout = settings['course_page_fanout']
+        self.http = pool.new_client()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = {'scos_done': 0, 'credited_seconds': 0, 'failed': False, 'drained': False}
+        self.http.session_manager = SessionManager(self.login, settings['session_ttl'])
         self.apis = self.init_api()
 
+    # 账号可覆盖的 [engine] 项：(键, 读取方法, 默认值)
+    ENGINE_SETTINGS = (
+        ('max_courses', 'get_int', 3),
+        ('max_scos', 'get_int', 1),
+        ('time_step', 'getfloat', 180),
+        ('course_page_size', 'get_int', 12),
+        ('course_page_fanout', 'get_int', 4),
+        ('session_ttl', 'get_int', 0),
+    )
+
+    @classmethod
+    def engine_settings(cls, config):
+        return {key: getattr(config, getter)('engine', key, default) for key, getter, default in cls.ENGINE_SETTINGS}
+
+    @classmethod
+    def check_config(cls, config):
+        """Read every per-account [engine] and [plan] value the way a bot will, so a bad
+        value rejects the config at load time instead of failing in StudyBot or reconfigure()."""
+        for key, getter, default in cls.ENGINE_SETTINGS:
+            try:
+                getattr(config, getter)('engine', key, default)
+            except ValueError as e:
+                raise Exception(f"invalid [engine] {key}: {str(e)}")
+        try:
+            CoursePlan(config)
+        except ValueError as e:
+            raise Exception(f"invalid [plan] value: {str(e)}")
+
     def init_api(self):
-        return {
-            'login': self._make_api('login'),
-            'save_progress': self._make_api('save_progress'),
-            'course_item': self._make_api('course_item'),
-            'select_resource': self._make_api('select_resource'),  # 修正拼写
-            'select_check': self._make_api('select_check'),
-            'update_timestep': self._make_api('update_timestep'),
-            'course_show': self._make_api('course_show'),
-            'heartbeat': self._make_api('heartbeat'),
-            'course_center': self._make_api('course_center'),
-            'enter_course': self._make_api('enter_course')
-        }
+        # 模板已编译缓存，同样的 host + 路径在所有账号间共用
+        return EndpointRegistry(self.config.get_section_items('api'))
 
-    def _make_api(self, api):
-        api_config = self.config.get_section_items('api')
-        if api in api_config:
-            return f"{api_config['host']}{api_config[api]}"
-        log(f'Warning: API:{api} is not configured')
-        return None
+    def reconfigure(self):
+        """Pick up a reloaded config: the API table is rebuilt and swapped in one assignment,
+        so requests already in flight finish on the old URLs and the next ones use the new."""
+        apis = self.init_api()
+        if apis != self.apis:
+            log(f"API endpoints changed for {self.account['username']}, switching")
+            self.apis = apis
+        plan = CoursePlan(self.config)
+        if plan != self.plan:
+            self.plan = plan
+            if self.course_queue is not None and not self.draining:
+                log(f"Credit plan changed for {self.account['username']}, re-planning courses not started yet")
+                if self._replan_task is not None:
+                    self._replan_task.cancel()
+                self._replan_task = asyncio.ensure_future(self.replan())
 
-    def login(self):
-        main_config = self.config.get_section_items('main')
-        username = main_config['username']
-        password = main_config['password']
-        corp_code = main_config['corpcode']
+    def drain(self):
+        """Stop starting courses and scos; scos in progress stop after their next save."""
+        if not self.draining:
+            log(f"Draining {self.account['username']}: finishing the current cycle, then stopping")
+            self.draining = True
+            self.progress['drained'] = True
+
+    async def login(self):
+        username = self.account['username']
+        password = self.account['password']
+        corp_code = self.account['corpcode']
         params = {
             'corpCode': corp_code,
             'loginName': username,
@@ -123,7 +1450,8 @@ class StudyBot:
             'securityCode': '',
             'continueLogin': 'true'
         }
-        response = self.http.post(self.apis['login'], params=params)
+        self.http.clear_cookies()
+        response = await self.http.post(self._build_api_url('login'), params=params, relogin=False)
         result = self.http.get_json(response)
         if self.http.get_session_id():
             log(f'User:{username} login successful!')
@@ -131,9 +1459,9 @@ class StudyBot:
             msg = result.get('message') if result else "Unknown error"
             raise Exception(f"Login might have failed. Error: {msg}")
 
-    def send_heartbeat(self):
+    async def send_heartbeat(self):
         try:
-            response = self.http.post(self.apis['heartbeat'], {'_ajax_toKen': 'os'})
+            response = await self.http.post(self._build_api_url('heartbeat'), self.HEARTBEAT_PARAMS, idempotent=True)
             result = self.http.get_json(response)
             if result:
                 log(f'Heartbeat sent, success: {result.get("success", False)}')
@@ -142,32 +1470,83 @@ class StudyBot:
         except Exception as e:
             log(f'Heartbeat failed. Error: {str(e)}')
 
-    def get_my_courses(self):
+    async def _get_course_page(self, page_no):
         params = {
-            'page.pageSize': '12',
+            'page.pageSize': str(self.course_page_size),
             'page.sortName': 'STUDYTIME',
-            'page.pageNo': '1',
-            '_': int(time.time())
+            'page.pageNo': str(page_no),
+            '_': int(clock.time())
         }
         try:
-            response = self.http.get(self.apis['course_center'])
+            response = await self.http.get(self._build_api_url('course_center'), params=params)
             if response.status_code == 200:
                 try:
                     result = response.json()
-                    log('Successfully retrieved course center')
-                    course_list_raw = result.get('rows', [])
-                    course_list = [i.get('courseId') for i in course_list_raw if i.get('getScoreTime') is None]
-                    log(f'Course center has {len(course_list)} unfinished courses')
-                    return course_list
+                    return result.get('rows', []), result.get('total')
                 except json.JSONDecodeError:
-                    log(f"Failed to parse JSON from course center response. Content: {response.text[:200]}...")
-                    return []
+                    log(f"Failed to parse JSON from course center response. Content: {response.text[:200]}...", WARNING)
             else:
-                log(f"Failed to retrieve course center. Status code: {response.status_code}")
-                return []
+                log(f"Failed to retrieve course center page {page_no}. Status code: {response.status_code}", WARNING)
         except Exception as e:
-            log(f'Failed to retrieve course center: {str(e)}')
-            return []
+            log(f'Failed to retrieve course center page {page_no}: {str(e)}', WARNING)
+        return [], None
+
+    async def iter_course_rows(self):
+        """Yield studyTaskList rows page by page, fetching pages concurrently once the total is known."""
+        rows, total = await self._get_course_page(1)
+        for row in rows:
+            yield row
+        try:
+            total = int(total)
+        except (TypeError, ValueError):
+            total = None
+
+        if total is None:
+            # 总数未知时逐页翻，直到不足一页；服务器不认页码时会一直返回同一页，没有新课程就停
+            seen = {row.get('courseId') for row in rows}
+            page_no = 1
+            while len(rows) >= self.course_page_size:
+                if page_no >= self.MAX_COURSE_PAGES:
+                    log(f"Course center still paging after {page_no} pages, stopping", WARNING)
+                    return
+                page_no += 1
+                rows, _ = await self._get_course_page(page_no)
+                new_rows = [row for row in rows if row.get('courseId') not in seen]
+                if not new_rows:
+                    if rows:
+                        log(f"Course center page {page_no} has no new courses, stopping", WARNING)
+                    return
+                seen.update(row.get('courseId') for row in new_rows)
+                for row in new_rows:
+                    yield row
+            return
+
+        page_count = -(-total // self.course_page_size)
+        if page_count > self.MAX_COURSE_PAGES:
+            log(f"Course center reports {total} courses, fetching only the first {self.MAX_COURSE_PAGES} pages", WARNING)
+            page_count = self.MAX_COURSE_PAGES
+        fanout = asyncio.Semaphore(self.course_page_fanout)
+
+        async def fetch(page_no):
+            async with fanout:
+                return await self._get_course_page(page_no)
+
+        pages = [asyncio.ensure_future(fetch(page_no)) for page_no in range(2, page_count + 1)]
+        try:
+            for page in asyncio.as_completed(pages):
+                rows, _ = await page
+                for row in rows:
+                    yield row
+        finally:
+            for page in pages:
+                page.cancel()
+
+    async def plan_courses(self):
+        """Course ids in study order, ranked by CoursePlan over all course center rows."""
+        rows = [row async for row in self.iter_course_rows()]
+        plan = self.plan.order(self.read_local_study_list([]), rows)
+        log(self.plan.describe(plan, rows))
+        return plan
 
     def read_local_study_list(self, course_list):
         study_list_path = os.path.join(os.getcwd(), '21tb', 'study.list')
@@ -176,241 +1555,875 @@ class StudyBot:
             prefer_list = []
             with open(study_list_path, encoding='utf-8') as f:
                 for course in f:
-                    prefer_list.append(course.strip())
+                    if course.strip():
+                        prefer_list.append(course.strip())
             prefer_list.extend(course_list)
-            return prefer_list
+            return list(dict.fromkeys(prefer_list))
         else:
             log("study.list file does not exist, will study directly")
-            return course_list
-
-    def get_course_items(self, course_id, pretty=False):
-        api = self._build_api_url('course_item', course_id=course_id, session_id=self.http.get_session_id())
-        log(f"Requesting course items from: {api}")
-        response = self.http.get(api)
-        log(f"Response status code: {response.status_code}")
-        log(f"Response headers: {response.headers}")
-        
+            return list(dict.fromkeys(course_list))
+
+    async def get_course_items(self, course_id, pretty=False):
+        username = self.account['username']
+        entry = self.tree_cache.get(self.account['corpcode'], course_id)
+        if entry is not None and username not in entry['done']:
+            # 目录是别的账号缓存的，本账号的完成状态只能从服务器拿：不带条件头请求，304 里没有这些信息
+            items_list = await self._fetch_course_items(course_id, None)
+        elif entry is not None and self.tree_cache.is_fresh(entry):
+            log(f"Using cached course items for {course_id}")
+            items_list = self.tree_cache.items_for(entry, username)
+        else:
+            items_list = await self._fetch_course_items(course_id, entry)
+
+        if pretty:
+            for i in items_list:
+                log(f'Course name: {i["name"]} {i["scoId"]}')
+            log(f'Total items: {len(items_list)}')
+        else:
+            return items_list
+
+    async def _fetch_course_items(self, course_id, entry):
+        username = self.account['username']
+        api = self._build_api_url('course_item', course_id=course_id)
+        debug(f"Requesting course items from: {api}")
+        response = await self.http.get(api, headers=self.tree_cache.validators(entry))
+        debug(f"Response status code: {response.status_code}")
+        if debug_enabled():
+            debug(f"Response headers: {response.headers}")
+        if response.status_code == 304 and entry is not None:
+            log(f"Course tree of {course_id} not modified, using cache")
+            self.tree_cache.touch(entry)
+            return self.tree_cache.items_for(entry, username)
+
         try:
             content_type = response.headers.get('Content-Type', '')
-            log(f"Content-Type: {content_type}")
-            
-            if 'text/html' in content_type:
-                # Parse HTML content
-                soup = BeautifulSoup(response.text, 'html.parser')
-                items_list = []
-                for item in soup.select('.cl-catalog-item-sub a'):
-                    items_list.append({
-                        'name': item.get('title', ''),
-                        'scoId': item.get('data-id', '')
-                    })
-            else:
-                # Attempt to parse as JSON (existing logic)
-                ret_json = response.json()
-                ret_json = ret_json[0]
-                children_list = ret_json.get('children', [])
-                items_list = []
-                for item in children_list:
-                    if len(item.get('children', [])) == 0:
+            debug(f"Content-Type: {content_type}")
+            items_list = self.parse_course_items(content_type, response.text)
+            if items_list:
+                self.tree_cache.put(self.account['corpcode'], course_id, items_list, username, response.headers)
+            return items_list
+        except Exception as e:
+            log(f"Error in get_course_items: {str(e)}", ERROR)
+            log(f"Response content: {response.text[:500]}...", ERROR)  # 只打印前500个字符
+            return []
+
+    @staticmethod
+    def parse_course_items(content_type, text):
+        if 'text/html' in content_type:
+            # Parse HTML content
+            parser = CatalogParser()
+            parser.feed(text)
+            parser.close()
+            items_list = parser.items
+        else:
+            # Attempt to parse as JSON (existing logic)
+            ret_json = json.loads(text)
+            ret_json = ret_json[0]
+            children_list = ret_json.get('children', [])
+            items_list = []
+            for item in children_list:
+                if len(item.get('children', [])) == 0:
+                    cell = {
+                        'name': item.get('text', ''),
+                        'scoId': item.get('id', ''),
+                        'done': StudyBot._json_item_done(item)
+                    }
+                    items_list.append(cell)
+                else:
+                    for i in item.get('children', []):
                         cell = {
-                            'name': item.get('text', ''),
-                            'scoId': item.get('id', '')
+                            'name': i.get('text', ''),
+                            'scoId': i.get('id', ''),
+                            'done': StudyBot._json_item_done(i)
                         }
                         items_list.append(cell)
-                    else:
-                        for i in item.get('children', []):
-                            cell = {
-                                'name': i.get('text', ''),
-                                'scoId': i.get('id', '')
-                            }
-                            items_list.append(cell)
-            
-            if pretty:
-                for i in items_list:
-                    log(f'Course name: {i["name"]} {i["scoId"]}')
-                log(f'Total items: {len(items_list)}')
-            else:
-                return items_list
-        except Exception as e:
-            log(f"Error in get_course_items: {str(e)}")
-            log(f"Response content: {response.text[:500]}...")  # 只打印前500个字符
-            return []
+        return items_list
 
-    def select_score_item(self, course_id, score_id):
-        params = {
-            'courseId': course_id,
-            'scoId': score_id,
-            'firstLoad': 'true'
-        }
-        r = self.http.post(self.apis['select_resource'], params)
-        try:
-            location = float(json.loads(r.text)['location'])
-        except:
-            location = 0.1
-        
-        # 修改这里
-        select_check_api = self.apis['select_check']
-        if '{courseId}' in select_check_api and '{scoId}' in select_check_api:
-            api = select_check_api.format(courseId=course_id, scoId=score_id)
-        elif '%s' in select_check_api:
-            api = select_check_api % (course_id, score_id)
+    @staticmethod
+    def _json_item_done(item):
+        # JSON 目录沿用 selectResource/saveProgress 的完成标识
+        return str(item.get('isComplete', item.get('completed', ''))).lower() == 'true'
+
+    async def select_score_item(self, course_id, score_id, resume_location=None):
+        if resume_location is None:
+            params = {
+                'courseId': course_id,
+                'scoId': score_id,
+                'firstLoad': 'true'
+            }
+            r = await self.http.post(self._build_api_url('select_resource'), params, idempotent=True)
+            try:
+                location = float(json.loads(r.text)['location'])
+            except:
+                location = 0.1
         else:
-            api = select_check_api.replace('{0}', course_id).replace('{1}', score_id)
+            # 从检查点恢复，位置已知，不再请求 selectResource
+            location = resume_location
         
-        r = self.http.post(api)
-        print(location)
+        api = self._build_api_url('select_check', course_id=course_id, sco_id=score_id)
+        r = await self.http.post(api, idempotent=True)
+        debug(f'Location: {location}')
         return location
 
-    def update_timestep(self):
+    async def update_timestep(self):
         try:
-            response = self.http.post(self.apis['update_timestep'])
+            response = await self.http.post(self._build_api_url('update_timestep'), idempotent=True)
             if response.status_code == 200:
                 result = response.text.strip()
                 log(f'Updated timestep, {result.capitalize()}')
             else:
-                log(f'Failed to update timestep. Status code: {response.status_code}')
+                log(f'Failed to update timestep. Status code: {response.status_code}', WARNING)
         except Exception as e:
-            log(f'Error updating timestep: {str(e)}')
+            log(f'Error updating timestep: {str(e)}', ERROR)
 
-    def save_progress(self, course_id, score_id, location):
+    async def save_progress(self, course_id, score_id, location):
         params = {
             'courseId': course_id,
             'scoId': score_id,
             # 'progress_measure': '400',
             'progress_measure': '100',
-            'session_time': '0:0:180',
+            # 与实际的采集间隔一致，和 credited_seconds_total 指标对得上
+            'session_time': f'0:0:{int(round(self.time_step))}',
             'location': location,
             'logId': '',
             'current_app_id': ''
         }
-        params.update({'courseId': course_id, 'scoId': score_id, 'location': location})
-        r = self.http.post(self.apis['save_progress'], params)
         try:
+            # 会累计学习时长，超时后重发可能记两次：失败就交给下一个周期
+            r = await self.http.post(self._build_api_url('save_progress'), params)
             result = self.http.get_json(r)
+            saved = bool(result)
             if not result:
                 params_res = {'courseId': course_id, 'scoId': score_id}
-                r = self.http.post(self.apis['select_resource'], params_res)
+                r = await self.http.post(self._build_api_url('select_resource'), params_res, idempotent=True)
                 result = self.http.get_json(r)
                 if result and result.get('isComplete') == 'true':
+                    self.checkpoints.record(self.account, course_id, score_id, location, True)
                     return True
             info = '\033\tcourseProgress: %s\tcompleteRate: %s\tcompleted: %s\t\033' %\
                    (result.get('courseProgress', '-'), result.get('completeRate'), result.get('completed', '-'))
             log(info)
-            if result and result.get('completed', '-') == 'true':
+            completed = result.get('completed', '-') == 'true'
+            if saved:
+                self.checkpoints.record(self.account, course_id, score_id, location, completed)
+                metrics.inc('credited_seconds_total', self.time_step, account=self.account['username'])
+                self.progress['credited_seconds'] += self.time_step
+            if completed:
                 return True
         except Exception as e:
-            log(f"Error in save_progress: {str(e)}")
+            log(f"Error in save_progress: {str(e)}", ERROR)
             log('Total progress:\t-\tSection:\t-')
         return False
 
     def _build_api_url(self, api_name, **kwargs):
         try:
-            base_url = self.apis[api_name]
-            for key, value in kwargs.items():
-                placeholder = '{' + key + '}'
-                if placeholder in base_url:
-                    base_url = base_url.replace(placeholder, str(value))
-            return base_url
-        except KeyError as e:
+            endpoint = self.apis[api_name]
+        except KeyError:
             log(f"API '{api_name}' not found in configuration")
             raise
-        except Exception as e:
-            log(f"Error building URL for API '{api_name}': {str(e)}")
-            raise
+        if 'session_id' in endpoint.fields and 'session_id' not in kwargs:
+            kwargs['session_id'] = self.http.get_session_id()
+        return endpoint.format(kwargs)
 
-    def study_course(self, course_id):
+    async def study_course(self, course_id):
         log(f"Starting course: {course_id}")
-        log(f"Session ID: {self.http.get_session_id()}")
+        debug(f"Session ID: {self.http.get_session_id()}")
         
         enter_course_url = self._build_api_url('enter_course', course_id=course_id)
-        log(f"Enter course URL: {enter_course_url}")
+        debug(f"Enter course URL: {enter_course_url}")
         
         try:
-            enter_course_response = self.http.post(enter_course_url)
-            log(f"Enter course response status: {enter_course_response.status_code}")
-            log(f"Enter course response content: {enter_course_response.text[:200]}...")
+            enter_course_response = await self.http.post(enter_course_url, idempotent=True)
+            debug(f"Enter course response status: {enter_course_response.status_code}")
+            if debug_enabled():
+                debug(f"Enter course response content: {enter_course_response.text[:200]}...")
             if enter_course_response.status_code != 200:
-                log(f"Failed to enter course. Status code: {enter_course_response.status_code}")
+                log(f"Failed to enter course. Status code: {enter_course_response.status_code}", WARNING)
                 return
         except Exception as e:
-            log(f"Error entering course: {str(e)}")
+            log(f"Error entering course: {str(e)}", ERROR)
             return
 
-        course_show_url = self._build_api_url('course_show', course_id=course_id, session_id=self.http.get_session_id())
-        log(f'Course show URL: {course_show_url}')
+        course_show_url = self._build_api_url('course_show', course_id=course_id)
+        debug(f'Course show URL: {course_show_url}')
         
         try:
-            course_show_response = self.http.post(course_show_url)
-            log(f"Course show response status: {course_show_response.status_code}")
-            log(f"Course show response content: {course_show_response.text[:200]}...")
+            course_show_response = await self.http.post(course_show_url, idempotent=True)
+            debug(f"Course show response status: {course_show_response.status_code}")
+            if debug_enabled():
+                debug(f"Course show response content: {course_show_response.text[:200]}...")
             if course_show_response.status_code != 200:
-                log(f"Failed to show course. Status code: {course_show_response.status_code}")
+                log(f"Failed to show course. Status code: {course_show_response.status_code}", WARNING)
                 return
         except Exception as e:
-            log(f"Error in course show: {str(e)}")
+            log(f"Error in course show: {str(e)}", ERROR)
             return
 
-        items_list = self.get_course_items(course_id)
+        items_list = await self.get_course_items(course_id)
         if not items_list:
             log(f"No course items found for course {course_id}")
             return
 
-        # time_step = 10
-        time_step = 180
         try:
             log('*' * 50)
             log(f'Total of {len(items_list)} sub-courses')
             for index, i in enumerate(items_list):
-                log(f'{index + 1}. {i["name"]} ')
+                log(f'{index + 1}. {i["name"]} {"(done)" if i.get("done") else ""}')
             log('*' * 50)
-            log('Beginning to study...')
+            progress = self.checkpoints.load(self.account, course_id)
+            for i in items_list:
+                if i['scoId'] in progress and progress[i['scoId']][1]:
+                    i['done'] = True
+            pending = [(index, i) for index, i in enumerate(items_list) if not i.get('done')]
+            if not pending:
+                log(f'\033[92m\tCOURSE ALREADY COMPLETED, URL: {course_show_url}\033[0m')
+                return
+            log(f'Beginning to study, skipping {len(items_list) - len(pending)} completed sub-courses...')
 
-            for index, i in enumerate(items_list):
-                sco_id = i['scoId']
-                log(f'Starting to study: {index + 1}-{i["name"]} {sco_id}')
-                location = self.select_score_item(course_id, sco_id)
+            sco_limit = asyncio.Semaphore(self.max_scos)
+            results = await asyncio.gather(
+                *(self.study_sco(course_id, index, i, sco_limit, progress.get(i['scoId'])) for index, i in pending),
+                return_exceptions=True)
+            failed = [r for r in results if isinstance(r, Exception)]
+            if failed:
+                self.progress['failed'] = True
+            for e in failed:
+                metrics.inc('errors_total', stage='sco')
+                log(f"Error in study_course for course_id {course_id}: {str(e)}", ERROR)
+                log(''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+            if self.draining:
+                log(f'Course {course_id} drained')
+            elif not failed:
+                log(f'\033[92m\tCOURSE COMPLETED, URL: {course_show_url}\033[0m')
+        except Exception as e:
+            metrics.inc('errors_total', stage='course')
+            self.progress['failed'] = True
+            log(f"Error in study_course for course_id {course_id}: {str(e)}", ERROR)
+            log(traceback.format_exc())
+
+    async def study_sco(self, course_id, index, item, sco_limit, checkpoint=None):
+        async with sco_limit:
+            if self.draining:
+                return
+            sco_id = item['scoId']
+            if checkpoint is None:
+                log(f'Starting to study: {index + 1}-{item["name"]} {sco_id}')
                 cnt = 0
-                while True:
-                    location += time_step * cnt
-                    cnt += 1
-                    log(f'Location: {location}')
-                    self.send_heartbeat()
-                    self.update_timestep()
-                    ret = self.save_progress(course_id, sco_id, location)
-                    if ret:
-                        log(f'{course_id}-{sco_id} completed, starting next')
-                        break
-                    log(f'*********** Studied for {time_step}s, continuing *************')
-                    # time.sleep(time_step/10)
-                    time.sleep(time_step)
-            log(f'\033[92m\tCOURSE COMPLETED, URL: {course_show_url}\033[0m')
+            else:
+                log(f'Resuming: {index + 1}-{item["name"]} {sco_id} at location {checkpoint[0]}')
+                cnt = 1  # 检查点位置已上报过，下一次直接前进
+            while True:
+                try:
+                    location = await self.select_score_item(
+                        course_id, sco_id, resume_location=checkpoint[0] if checkpoint else None)
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    # 服务器维护等情况：隔一个周期再进入小节，而不是放弃整门课
+                    log(f'Failed to enter {course_id}-{sco_id}: {e!r}, retrying in {self.time_step}s', WARNING)
+                    await clock.sleep(self.time_step)
+                    if self.draining:
+                        return
+            state = {'course_id': course_id, 'sco_id': sco_id, 'location': location, 'cnt': cnt}
+            timer = self.scheduler.call_every(self.time_step, self._sco_tick, state)
+            metrics.add('active_scos', 1)
+            try:
+                await timer.done
+            finally:
+                timer.cancel()
+                metrics.add('active_scos', -1)
+            if state.get('drained'):
+                log(f'{course_id}-{sco_id} drained at location {state["location"]}')
+                return
+            metrics.inc('scos_completed_total')
+            self.progress['scos_done'] += 1
+            self.tree_cache.mark_done(self.account['corpcode'], course_id, self.account['username'], sco_id)
+            log(f'{course_id}-{sco_id} completed, starting next')
+
+    async def _sco_tick(self, state):
+        state['location'] += self.time_step * state['cnt']
+        state['cnt'] += 1
+        debug(f'Location: {state["location"]}')
+        ret = await self.save_progress(state['course_id'], state['sco_id'], state['location'])
+        if not ret and self.draining:
+            # 本周期已上报并写入检查点，之后可从这里继续
+            state['drained'] = True
+            return True
+        if not ret:
+            log(f'*********** Studied for {self.time_step}s, continuing *************')
+        return ret
+
+    async def _session_tick(self):
+        # 心跳和计时同步按会话发送，与同时学习的小节数无关
+        await self.send_heartbeat()
+        await self.update_timestep()
+        return False
+
+    async def _study_one_course(self, course_id):
+        current_course.set(course_id)
+        try:
+            await self.study_course(course_id)
         except Exception as e:
-            log(f"Error in study_course for course_id {course_id}: {str(e)}")
-            import traceback
+            metrics.inc('errors_total', stage='course')
+            self.progress['failed'] = True
+            log(f"Exception occurred while studying course {course_id}: {str(e)}", ERROR)
+            log(f"Error details: {type(e).__name__}", ERROR)
             log(traceback.format_exc())
 
-    def run(self):
-        start_time = time.time()
+    async def _course_worker(self):
+        # 每个 worker 依次取计划队列的下一门课；重新规划只替换还没开始的部分
+        while self.course_queue and not self.draining:
+            course_id = self.course_queue.popleft()
+            self.started_courses.add(course_id)
+            await self._study_one_course(course_id)
+
+    def _start_course_workers(self):
+        for _ in range(min(self.max_courses - len(self.course_workers), len(self.course_queue))):
+            task = asyncio.ensure_future(self._course_worker())
+            self.course_workers.add(task)
+            task.add_done_callback(self.course_workers.discard)
+
+    async def replan(self):
+        current_account.set(self.account['username'])
+        plan = await self.plan_courses()
+        self.course_queue = collections.deque(c for c in plan if c not in self.started_courses)
+        self._start_course_workers()
+
+    async def run(self):
+        current_account.set(self.account['username'])
+        self.started_at = start_time = clock.time()
+        metrics.add('active_sessions', 1)
         try:
-            self.login()  # 初始登录
-            course_list = self.read_local_study_list(self.get_my_courses())
-            for course_id in course_list:
-                try:
-                    # self.login()  # 在每个课程开始前重新登录
-                    self.study_course(course_id)
-                except Exception as e:
-                    log(f"Exception occurred while studying course {course_id}: {str(e)}")
-                    log(f"Error details: {type(e).__name__}")
-                    import traceback
-                    log(traceback.format_exc())
+            await self.http.session_manager.login()  # 初始登录
+            session_timer = self.scheduler.call_every(self.time_step, self._session_tick)
+            try:
+                # 最多 max_courses 个 worker 按计划顺序取课
+                self.course_queue = collections.deque(await self.plan_courses())
+                self._start_course_workers()
+                while self.course_workers:
+                    await asyncio.wait(list(self.course_workers))
+            finally:
+                session_timer.cancel()
+                for task in list(self.course_workers):
+                    task.cancel()
+                if self._replan_task is not None:
+                    self._replan_task.cancel()
         except Exception as e:
-            log(f"Critical error in main process: {str(e)}")
-            log(f"Error details: {type(e).__name__}")
-            import traceback
+            metrics.inc('errors_total', stage='session')
+            self.progress['failed'] = True
+            log(f"Critical error in main process: {str(e)}", ERROR)
+            log(f"Error details: {type(e).__name__}", ERROR)
             log(traceback.format_exc())
         finally:
-            duration = int(time.time() - start_time)
+            await self.http.close()
+            metrics.add('active_sessions', -1)
+            self.finished_at = clock.time()
+            duration = int(self.finished_at - start_time)
             log(f'Main process ended, duration: {duration}s')
 
+class SamplingProfiler:
+    """Samples the event loop thread's stack and writes collapsed stacks (flamegraph input)."""
+    def __init__(self, path, interval=0.005):
+        self.path = path
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+class CProfiler:
+    def __init__(self, path):
+        self.path = path
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.profile.dump_stats(self.path)
+
+def instance_path(path, instance):
+    """Per-worker variant of a file name: study.prof -> study.w0.prof; unchanged when instance is None."""
+    if not path or instance is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}.w{instance}{ext}'
+
+class MetricsExporter:
+    """Publishes `metrics` over a Prometheus text endpoint and/or periodic JSON snapshots,
+    and optionally profiles the study loop. Worker processes pass their `instance` so that
+    ports and files don't collide (port + instance + 1, name.w<instance>.ext)."""
+    def __init__(self, config, scheduler, instance=None):
+        self.port = config.get_int('metrics', 'prometheus_port', 0)
+        self.host = config.get('metrics', 'prometheus_host', '127.0.0.1')
+        if self.port and instance is not None:
+            self.port += instance + 1
+        snapshot_file = config.get('metrics', 'snapshot_file', '')
+        self.snapshot_path = instance_path(os.path.join(config.work_dir, snapshot_file), instance) \
+            if snapshot_file else None
+        self.snapshot_interval = config.getfloat('metrics', 'snapshot_interval', 60)
+        profile = config.get('metrics', 'profile', '')
+        profile_path = instance_path(
+            os.path.join(config.work_dir, config.get('metrics', 'profile_file', 'study.prof')), instance)
+        if profile == 'cprofile':
+            self.profiler = CProfiler(profile_path)
+        elif profile == 'sample':
+            self.profiler = SamplingProfiler(profile_path)
+        else:
+            self.profiler = None
+        self.scheduler = scheduler
+        self._runner = None
+        self._timer = None
+
+    async def start(self):
+        if self.port:
+            from aiohttp import web
+
+            async def handle_metrics(request):
+                return web.Response(text=metrics.render_prometheus(), content_type='text/plain')
+
+            app = web.Application()
+            app.router.add_get('/metrics', handle_metrics)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            log(f'Serving metrics on {self.host}:{self.port}/metrics')
+        if self.snapshot_path:
+            self._timer = self.scheduler.call_every(self.snapshot_interval, self._write_snapshot)
+        if self.profiler is not None:
+            self.profiler.start()
+
+    async def _write_snapshot(self):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(metrics.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp_path, self.snapshot_path)
+        return False
+
+    async def stop(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            log(f'Profile written to {self.profiler.path}')
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.snapshot_path:
+            await self._write_snapshot()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+def configure_logging(config, instance=None):
+    log_file = config.get('log', 'file', '')
+    log_writer.configure(level=config.get('log', 'level', 'info'),
+                         fmt=config.get('log', 'format', 'text'),
+                         path=instance_path(os.path.join(config.work_dir, log_file), instance) if log_file else None,
+                         max_bytes=config.get_int('log', 'max_bytes', 10 * 1024 * 1024),
+                         backups=config.get_int('log', 'backups', 5),
+                         to_stdout=config.getboolean('log', 'stdout', True))
+
+class FleetRunner:
+    """Runs accounts in one process over a shared connection pool. `instance` is the worker
+    number when running under a Supervisor (None for the single-process mode)."""
+    def __init__(self, config_file_path=None, pool=None, instance=None):
+        self.config = ConfigManager(config_file_path)
+        self.config.initialize()
+        self.instance = instance
+        configure_logging(self.config, instance)
+        self.pool = pool if pool is not None else ConnectionPool.from_config(self.config)
+        self.bots = []
+        self.jitter = self.config.getfloat('engine', 'jitter', 0.1)
+        # 目录缓存会整体重写(compact)，每个 worker 各用一份；检查点库由 SQLite 负责多进程共享
+        tree_file = self.config.get('cache', 'course_tree_file', '')
+        self.tree_cache = CourseTreeCache(instance_path(os.path.join(self.config.work_dir, tree_file), instance)
+                                          if tree_file else None,
+                                          self.config.get_int('cache', 'course_tree_ttl', 86400))
+        checkpoint_file = self.config.get('cache', 'checkpoint_file', '')
+        self.checkpoints = CheckpointStore(os.path.join(self.config.work_dir, checkpoint_file)
+                                           if checkpoint_file else ':memory:')
+        self.scheduler = None
+        self.exporter = None
+        self.active = {}  # 账号 -> 正在运行的 StudyBot
+        self.finished = set()
+        self.tasks = set()
+        # 是否按配置增减账号；Supervisor 下的 worker 由主进程分配账号
+        self.manage_accounts = True
+        self.wanted = {}
+        self.on_done = None
+
+    async def start(self):
+        self.scheduler = TimerScheduler(jitter=self.jitter)
+        self.exporter = MetricsExporter(self.config, self.scheduler, self.instance)
+        await self.exporter.start()
+        reload_interval = self.config.getfloat('engine', 'config_reload_interval', 5)
+        if reload_interval > 0:
+            self.scheduler.call_every(reload_interval, self._watch_config)
+
+    def new_bot(self, account):
+        bot = StudyBot(self.config.for_account(account), account, self.pool, self.scheduler,
+                       self.tree_cache, self.checkpoints)
+        self.bots.append(bot)
+        return bot
+
+    def add_account(self, account):
+        key = account_key(account)
+        bot = self.new_bot(account)
+        self.active[key] = bot
+        task = asyncio.ensure_future(bot.run())
+        self.tasks.add(task)
+        task.add_done_callback(lambda _: self._bot_done(key, bot, task))
+        return bot
+
+    def _bot_done(self, key, bot, task):
+        self.tasks.discard(task)
+        if self.active.get(key) is bot:
+            del self.active[key]
+        if not bot.draining:
+            self.finished.add(key)
+        elif self.manage_accounts and key in self.wanted:
+            # 排空期间账号又被加回配置：等旧会话退出后重新开始，从检查点继续
+            self.add_account(self.wanted[key])
+        if self.on_done is not None:
+            self.on_done(key, bot)
+
+    async def _watch_config(self):
+        if self.config.changed():
+            try:
+                accounts = self.config.reload()
+            except Exception as e:
+                log(f'Config reload failed, keeping the previous config: {str(e)}', WARNING)
+                return False
+            try:
+                self.apply_accounts(accounts)
+            except Exception as e:
+                # 监视定时器抛出异常就不会再触发，这里兜底，保证热加载一直有效
+                log(f'Applying the reloaded config failed: {str(e)}', ERROR)
+        return False
+
+    def apply_accounts(self, accounts):
+        """Apply a reloaded account list: running bots get their new settings and API table,
+        removed accounts are drained and, when managing accounts, new ones are started."""
+        wanted = {account_key(account): account for account in accounts}
+        for key, bot in list(self.active.items()):
+            account = wanted.get(key)
+            if account is None:
+                if self.manage_accounts:
+                    log(f'Account {key} removed from config')
+                    bot.drain()
+                continue
+            if bot.draining:
+                continue
+            if account != bot.account:
+                # 原地更新，AccountConfig 视图随之生效(密码、覆盖项)
+                bot.account.clear()
+                bot.account.update(account)
+            bot.reconfigure()
+        if not self.manage_accounts:
+            return
+        self.wanted = wanted
+        for key, account in wanted.items():
+            if key not in self.active and key not in self.finished:
+                log(f'Account {key} added to config')
+                self.add_account(account)
+
+    async def stop(self):
+        await self.exporter.stop()
+        await self.scheduler.close()
+        log(f'HTTP stats: {self.pool.stats}')
+        await self.pool.close()
+        self.checkpoints.close()
+        self.tree_cache.close()
+
+    async def run(self, accounts=None):
+        self.manage_accounts = accounts is None
+        if accounts is None:
+            accounts = self.config.get_accounts()
+        log(f'Loaded {len(accounts)} accounts')
+        self.wanted = {account_key(account): account for account in accounts}
+        await self.start()
+        try:
+            for account in accounts:
+                self.add_account(account)
+            # 运行中可能因配置变化加入新账号，直到全部结束
+            while self.tasks:
+                await asyncio.wait(list(self.tasks))
+        finally:
+            await self.stop()
+
+def account_key(account):
+    return f"{account['corpcode']}:{account['username']}"
+
+def shard_of(account, workers):
+    """Stable shard number: the same account lands on the same worker across runs,
+    which keeps its course tree cache warm."""
+    return zlib.crc32(account_key(account).encode('utf-8')) % workers
+
+async def _worker_loop(instance, config_file_path, tasks, events):
+    runner = FleetRunner(config_file_path, instance=instance)
+    # 账号的增减由 Supervisor 决定，worker 只应用接口和单账号配置的变化
+    runner.manage_accounts = False
+    status_interval = runner.config.getfloat('supervisor', 'status_interval', 30)
+    loop = asyncio.get_running_loop()
+
+    async def report():
+        events.put(('status', instance, {key: dict(bot.progress) for key, bot in runner.active.items()}))
+        return False
+
+    def done(key, bot):
+        runner.bots.remove(bot)
+        events.put(('done', instance, key, dict(bot.progress)))
+
+    runner.on_done = done
+    await runner.start()
+    timer = runner.scheduler.call_every(status_interval, report)
+    try:
+        while True:
+            # 阻塞读队列放到线程里，不卡住事件循环
+            message = await loop.run_in_executor(None, tasks.get)
+            if message is None:
+                break
+            kind, payload = message
+            if kind == 'drain':
+                bot = runner.active.get(payload)
+                if bot is not None:
+                    bot.drain()
+            else:
+                runner.add_account(payload)
+        while runner.tasks:
+            await asyncio.wait(list(runner.tasks))
+    finally:
+        timer.cancel()
+        await runner.stop()
+
+def _worker_main(instance, config_file_path, tasks, events):
+    try:
+        asyncio.run(_worker_loop(instance, config_file_path, tasks, events))
+    finally:
+        log_writer.flush()
+
+class WorkerHandle:
+    """Supervisor-side view of one worker process."""
+    def __init__(self, instance):
+        self.instance = instance
+        self.process = None
+        self.tasks = None
+        self.in_flight = {}
+        self.status = {}
+        self.restarts = 0
+        self.retired = False
+        self.done = 0
+
+class Supervisor:
+    """Runs accounts across worker processes, each one a FleetRunner.
+
+    Accounts are sharded by a stable hash and handed out lazily, at most
+    `accounts_per_worker` in flight per worker; a worker whose shard runs dry steals
+    from the longest remaining shard. A crashed worker is restarted and its in-flight
+    accounts are requeued, resuming from the shared checkpoint store."""
+    def __init__(self, config_file_path=None, workers=None):
+        self.config_file_path = config_file_path
+        self.config = ConfigManager(config_file_path)
+        self.config.initialize()
+        configure_logging(self.config)
+        self.workers = workers or self.config.get_int('supervisor', 'workers', 0) or os.cpu_count() or 1
+        self.accounts_per_worker = self.config.get_int('supervisor', 'accounts_per_worker', 200)
+        self.status_interval = self.config.getfloat('supervisor', 'status_interval', 30)
+        self.max_restarts = self.config.get_int('supervisor', 'max_restarts', 5)
+        # spawn: 子进程不继承父进程的事件循环、日志线程和 sqlite 连接
+        self.ctx = multiprocessing.get_context('spawn')
+        self.events = self.ctx.Queue()
+        self.handles = [WorkerHandle(i) for i in range(self.workers)]
+        self.pending = [collections.deque() for _ in range(self.workers)]
+        self.finished = {}
+        self.wanted = {}
+        self.reload_interval = self.config.getfloat('engine', 'config_reload_interval', 5)
+
+    def _spawn(self, handle):
+        handle.tasks = self.ctx.Queue()
+        handle.process = self.ctx.Process(target=_worker_main, name=f'study-worker-{handle.instance}',
+                                          args=(handle.instance, self.config_file_path, handle.tasks, self.events),
+                                          daemon=True)
+        handle.process.start()
+        log(f'Worker {handle.instance} started, pid {handle.process.pid}')
+
+    def _next_account(self, handle):
+        own = self.pending[handle.instance]
+        if own:
+            return own.popleft()
+        # 自己的分片已学完：从已满载(或已放弃)的 worker 中剩余最多的分片尾部"偷"一个，避免某个进程拖到最后
+        victims = [self.pending[other.instance] for other in self.handles
+                   if other.retired or len(other.in_flight) >= self.accounts_per_worker]
+        victim = max(victims, key=len, default=None)
+        if victim:
+            return victim.pop()
+        return None
+
+    def _dispatch(self):
+        for handle in self.handles:
+            if handle.retired:
+                continue
+            while len(handle.in_flight) < self.accounts_per_worker:
+                account = self._next_account(handle)
+                if account is None:
+                    break
+                handle.in_flight[account_key(account)] = account
+                handle.tasks.put(('run', account))
+
+    def _handle_event(self, event):
+        kind, instance = event[0], event[1]
+        handle = self.handles[instance]
+        if kind == 'status':
+            handle.status = event[2]
+        elif kind == 'done':
+            key, progress = event[2], event[3]
+            if handle.in_flight.pop(key, None) is None:
+                return
+            if not progress['drained']:
+                self.finished[key] = progress
+                handle.done += 1
+            elif key in self.wanted:
+                # 排空期间账号又被加回配置：重新排队，从检查点继续
+                account = self.wanted[key]
+                self.pending[shard_of(account, self.workers)].appendleft(account)
+            handle.status.pop(key, None)
+
+    def _check_workers(self):
+        for handle in self.handles:
+            if handle.retired or handle.process.is_alive():
+                continue
+            log(f'Worker {handle.instance} exited with code {handle.process.exitcode}, '
+                f'requeueing {len(handle.in_flight)} accounts', WARNING)
+            # 放回本分片队首；检查点库里有已确认的进度，重启后从断点继续
+            requeue = [account for key, account in handle.in_flight.items() if key in self.wanted]
+            self.pending[handle.instance].extendleft(reversed(requeue))
+            handle.in_flight.clear()
+            handle.status = {}
+            if handle.restarts >= self.max_restarts:
+                log(f'Worker {handle.instance} crashed {handle.restarts} times, giving up on it', ERROR)
+                handle.retired = True
+                continue
+            handle.restarts += 1
+            self._spawn(handle)
+
+    def _reload(self):
+        if not self.config.changed():
+            return
+        try:
+            accounts = self.config.reload()
+        except Exception as e:
+            log(f'Config reload failed, keeping the previous config: {str(e)}', WARNING)
+            return
+        self.wanted = wanted = {account_key(account): account for account in accounts}
+        queued = set(self.finished)
+        for shard, pending in enumerate(self.pending):
+            self.pending[shard] = collections.deque(wanted[account_key(account)] for account in pending
+                                                    if account_key(account) in wanted)
+            queued.update(account_key(account) for account in self.pending[shard])
+        for handle in self.handles:
+            for key in handle.in_flight:
+                queued.add(key)
+                if key not in wanted and not handle.retired:
+                    log(f'Account {key} removed from config, draining on worker {handle.instance}')
+                    handle.tasks.put(('drain', key))
+        for key, account in wanted.items():
+            if key not in queued:
+                log(f'Account {key} added to config')
+                self.pending[shard_of(account, self.workers)].append(account)
+
+    def status_lines(self):
+        total = sum(len(p) for p in self.pending) + len(self.finished) + \
+            sum(len(h.in_flight) for h in self.handles)
+        lines = [f'Accounts: {len(self.finished)}/{total} done']
+        scos_done = sum(p['scos_done'] for p in self.finished.values())
+        credited = sum(p['credited_seconds'] for p in self.finished.values())
+        failed = sum(1 for p in self.finished.values() if p['failed'])
+        for handle in self.handles:
+            running = handle.status.values()
+            scos_done += sum(p['scos_done'] for p in running)
+            credited += sum(p['credited_seconds'] for p in running)
+            state = 'retired' if handle.retired else f'pid {handle.process.pid}'
+            lines.append(f'  worker {handle.instance} ({state}): running {len(handle.in_flight)}, '
+                         f'queued {len(self.pending[handle.instance])}, done {handle.done}, '
+                         f'restarts {handle.restarts}')
+        lines.append(f'Scos completed: {scos_done}, credited: {credited / 3600:.1f}h, failed accounts: {failed}')
+        return lines
+
+    def _log_status(self):
+        for line in self.status_lines():
+            log(line)
+
+    def run(self):
+        accounts = self.config.get_accounts()
+        self.wanted = {account_key(account): account for account in accounts}
+        for account in accounts:
+            self.pending[shard_of(account, self.workers)].append(account)
+        log(f'Loaded {len(accounts)} accounts, {self.workers} workers, '
+            f'shards: {[len(p) for p in self.pending]}')
+        for handle in self.handles:
+            self._spawn(handle)
+        next_status = time.monotonic() + self.status_interval
+        next_reload = time.monotonic() + self.reload_interval
+        try:
+            while any(self.pending) or any(h.in_flight for h in self.handles):
+                if all(h.retired for h in self.handles):
+                    raise Exception('All workers have crashed too often, stopping')
+                self._dispatch()
+                try:
+                    self._handle_event(self.events.get(timeout=1))
+                    while True:
+                        self._handle_event(self.events.get_nowait())
+                except queue.Empty:
+                    pass
+                self._check_workers()
+                if self.reload_interval > 0 and time.monotonic() >= next_reload:
+                    self._reload()
+                    next_reload = time.monotonic() + self.reload_interval
+                if time.monotonic() >= next_status:
+                    self._log_status()
+                    next_status = time.monotonic() + self.status_interval
+        finally:
+            for handle in self.handles:
+                if not handle.retired and handle.process.is_alive():
+                    handle.tasks.put(None)
+            for handle in self.handles:
+                if handle.process is not None:
+                    handle.process.join(timeout=60)
+                    if handle.process.is_alive():
+                        handle.process.terminate()
+            self._log_status()
+
 if __name__ == '__main__':
-    study_bot = StudyBot()
-    study_bot.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='21tb study robot')
+    parser.add_argument('-c', '--config', default=None, help='config file, defaults to main.conf next to this script')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='worker processes; 0 runs in this process (default: [supervisor] workers)')
+    args = parser.parse_args()
+    try:
+        workers = args.workers
+        if workers is None:
+            config = ConfigManager(args.config)
+            config.initialize()
+            workers = config.get_int('supervisor', 'workers', 0)
+        if workers > 0:
+            Supervisor(args.config, workers).run()
+        else:
+            asyncio.run(FleetRunner(args.config).run())
+    finally:
+        log_writer.flush()